@@ -0,0 +1,515 @@
+"""
+A simulated Junos console, used to measure netconify without hardware.
+
+FakeJunos is the device side of a console session: it is fed the bytes
+netconify writes and answers with the loader, login, shell and CLI
+prompts, and with canned NETCONF replies once 'xml-mode netconf
+need-trailer' (or 'junoscript ...' from the CLI) has been entered.  The
+output can be paced to a line rate, e.g. 960 bytes/s for 9600 baud.
+
+The device is reachable the same ways as a real console:
+
+    serve_pty()     a pty pair, the slave path stands in for /dev/ttyUSB0
+    serve_telnet()  a TCP listener, like a terminal server port
+    serve_ssh()     a paramiko SSH server, like a console server
+
+each returns what netconify needs to connect, and serves sessions from
+a daemon thread.
+"""
+import os
+import re
+import socket
+import threading
+from time import sleep, time
+
+__all__ = ['FakeJunos', 'serve_pty', 'serve_telnet', 'serve_ssh']
+
+_EOM = ']]>]]>'
+_RPC = re.compile(r'<rpc(?:\s+message-id="([^"]*)")?\s*>\s*<([\w-]+)(.*?)</rpc>',
+                  re.S)
+
+_HELLO = """<!-- No zombies were killed during the creation of this user interface -->
+<!-- user {user}, class super-user -->
+<hello xmlns="urn:ietf:params:xml:ns:netconf:base:1.0">
+<capabilities>
+<capability>urn:ietf:params:netconf:base:1.0</capability>
+<capability>http://xml.juniper.net/netconf/junos/1.0</capability>
+</capabilities>
+<session-id>4242</session-id>
+</hello>
+"""
+
+_REPLY = """<rpc-reply xmlns="urn:ietf:params:xml:ns:netconf:base:1.0" \
+xmlns:junos="http://xml.juniper.net/junos/15.1R1/junos"{msgid}>
+{body}
+</rpc-reply>
+"""
+
+_SOFTWARE = """<software-information>
+<host-name>{hostname}</host-name>
+<product-model>{model_lc}</product-model>
+<product-name>{model_lc}</product-name>
+<junos-version>15.1R1</junos-version>
+<package-information>
+<name>junos</name>
+<comment>JUNOS Base OS boot [15.1R1]</comment>
+</package-information>
+</software-information>"""
+
+_MODULE = """<chassis-module>
+<name>FPC {n}</name>
+<version>REV 01</version>
+<part-number>650-0{n:05d}</part-number>
+<serial-number>FK{n:08d}</serial-number>
+<description>{model} 48x10G</description>
+<model-number>{model}-48S-AFI</model-number>
+</chassis-module>"""
+
+_CONFIG = """## Last commit: 2016-03-17 10:00:00 UTC by root
+version 15.1R1;
+system {{
+    host-name {hostname};
+    root-authentication {{
+        encrypted-password "$1$fake$fake"; ## SECRET-DATA
+    }}
+}}
+interfaces {{
+    xe-0/0/0 {{
+        description "uplink ## core {{a}}";
+    }}
+}}
+"""
+
+_IFD = """<physical-interface>
+<name>{name}</name>
+<admin-status>up</admin-status>
+<oper-status>up</oper-status>
+<snmp-index>{index}</snmp-index>
+<speed>1000mbps</speed>
+<duplex>Full-Duplex</duplex>
+<current-physical-address>00:05:86:71:{index:02x}:00</current-physical-address>
+</physical-interface>"""
+
+
+class FakeJunos(object):
+
+    """
+    the device side of one console session
+    """
+
+    def __init__(self, write, **kvargs):
+        """
+        :write:
+          callable that sends bytes towards netconify
+
+        kvargs['rate']
+          output line rate in bytes/s, defaults to no limit
+
+        kvargs['loader']
+          start at the loader prompt, booting on 'boot'
+
+        kvargs['passwd']
+          the accepted password, defaults to empty (NOOB)
+
+        kvargs['hostname'], kvargs['model'], kvargs['serial']
+          identity reported in the facts
+
+        kvargs['modules']
+          number of FPC modules in the chassis inventory, to scale the
+          size of the get-chassis-inventory reply
+
+        kvargs['boot']
+          seconds a reboot or zeroize takes until the login prompt,
+          defaults to 2
+        """
+        self._write = write
+        self.rate = kvargs.get('rate')
+        self.passwd = kvargs.get('passwd', '')
+        self.hostname = kvargs.get('hostname', 'fake-sw1')
+        self.model = kvargs.get('model', 'QFX5100-48S-6Q')
+        self.serial = kvargs.get('serial', 'FK0000000001')
+        self.modules = kvargs.get('modules', 8)
+        self.boot = kvargs.get('boot', 2)
+        self.reboots = 0
+        self.loaded = []            # configuration texts loaded
+        self.user = None
+        self.state = 'loader' if kvargs.get('loader') else 'login'
+        self._shell_parent = False
+        self._speed_confirm = False
+        self._rxbuf = ''
+        self._lock = threading.Lock()
+
+    # -------------------------------------------------------------------------
+    # output
+    # -------------------------------------------------------------------------
+
+    def send(self, data):
+        """ send :data:, paced to the line rate """
+        data = data.replace('\r\n', '\n').replace('\n', '\r\n')
+        if not self.rate:
+            self._write(data)
+            return
+        chunk = max(1, int(self.rate) // 100)  # ~10ms worth at a time
+        for offset in range(0, len(data), chunk):
+            self._write(data[offset:offset + chunk])
+            sleep(float(len(data[offset:offset + chunk])) / self.rate)
+
+    def _prompt(self):
+        prompts = {
+            'loader': 'loader> ',
+            'login': '\n{0} (ttyu0)\n\nlogin: '.format(self.hostname),
+            'passwd': 'Password:',
+            'shell': '{0}@{1}:RE:0% '.format(self.user, self.hostname),
+            'cli': '{0}@{1}> '.format(self.user, self.hostname)
+        }
+        self.send(prompts[self.state])
+
+    # -------------------------------------------------------------------------
+    # input
+    # -------------------------------------------------------------------------
+
+    def feed(self, data):
+        """ process the bytes received from netconify """
+        with self._lock:
+            self._rxbuf += data
+            if self.state == 'booting':
+                self._rxbuf = ''            # nobody is listening
+                return
+            if self.state == 'xml':
+                self._xml_input()
+                return
+            lines = self._rxbuf.split('\n')
+            self._rxbuf = lines.pop()
+            if self.state == 'login' and len(lines) > 1 and not any(lines):
+                # <ENTER> typed ahead at the login prompt reprints it once
+                lines = ['']
+            for line in lines:
+                self._line(line.strip('\r'))
+                if self.state == 'xml':
+                    # anything following the xml-mode command is XML
+                    self._rxbuf = '\n'.join(lines[lines.index(line) + 1:]) + \
+                        self._rxbuf
+                    self._xml_input()
+                    return
+
+    def _line(self, line):
+        state = self.state
+        if state not in ('login', 'passwd'):
+            self.send(line + '\n')          # echo
+
+        if state == 'loader':
+            if line == 'boot':
+                # anything typed while booting is lost, as on the device
+                self.send('Booting [/kernel]...\n')
+                self.state = 'booting'
+                threading.Thread(target=self._boot, args=(0.2,)).start()
+                return
+            self._prompt()
+
+        elif state == 'login':
+            if line:
+                self.user = line
+                self.state = 'passwd'
+            self._prompt()
+
+        elif state == 'passwd':
+            if line == self.passwd:
+                self.send('\n--- JUNOS 15.1R1 built 2016-03-17\n')
+                self.state = 'shell' if self.user == 'root' else 'cli'
+                self._shell_parent = False
+            else:
+                self.send('\nLogin incorrect\n')
+                self.state = 'login'
+            self._prompt()
+
+        elif state in ('shell', 'cli'):
+            self._command(line)
+
+    def _command(self, line):
+        words = line.split()
+        cmd = words[0] if words else ''
+
+        if line in ('xml-mode netconf need-trailer',
+                    'junoscript netconf need-trailer'):
+            self._xml_return = self.state
+            self.state = 'xml'
+            self.send(_HELLO.format(user=self.user) + _EOM + '\n')
+            return
+
+        if cmd == 'sh' and 'stty' in line:
+            # the speed change waits for a line to confirm it
+            self._speed_confirm = True
+            return
+        if self._speed_confirm is True:
+            self._speed_confirm = False
+            self._prompt()
+            return
+
+        if cmd == 'exit':
+            if self.state == 'cli' and self._shell_parent:
+                self.state = 'shell'
+            else:
+                self.send('\n')
+                self.state = 'login'
+        elif cmd == 'cli' and self.state == 'shell':
+            self._shell_parent = True
+            self.state = 'cli'
+        elif cmd == 'start' and self.state == 'cli':
+            self.state = 'shell'
+        elif cmd in ('', 'stty', 'md5', 'gunzip', 'rm', 'uudecode'):
+            pass
+        else:
+            self.send('{0}: Command not found.\n'.format(cmd))
+        self._prompt()
+
+    # -------------------------------------------------------------------------
+    # NETCONF
+    # -------------------------------------------------------------------------
+
+    def _xml_input(self):
+        while True:
+            got = _RPC.search(self._rxbuf)
+            if got is None:
+                return
+            self._rxbuf = self._rxbuf[got.end():]
+            msgid, name, rest = got.groups()
+            self._rpc(name, rest, msgid)
+            if self.state != 'xml':
+                self._rxbuf = ''
+                return
+
+    def _rpc(self, name, rest, msgid):
+        handler = getattr(self, '_rpc_' + name.replace('-', '_'), None)
+        body = handler(rest) if handler is not None else '<ok/>'
+        msgid = ' message-id="{0}"'.format(msgid) if msgid else ''
+        self.send(_REPLY.format(msgid=msgid, body=body) + _EOM + '\n')
+        if name == 'close-session':
+            self.state = self._xml_return
+            self._prompt()
+        elif name == 'request-reboot' or (name == 'command' and
+                                          'zeroize' in rest):
+            self.state = 'booting'
+            threading.Thread(target=self._reboot).start()
+
+    def _reboot(self):
+        """ shut down, boot for :boot: seconds, then prompt for login """
+        self.reboots += 1
+        self.send('\n*** FINAL System shutdown message from root@{0} ***\n'
+                  'System going down IMMEDIATELY\n\nWaiting (max 60 seconds) '
+                  'for system process to stop...\nRebooting...\n'.format(
+                      self.hostname))
+        self._boot(self.boot)
+
+    def _boot(self, seconds):
+        """ boot for :seconds:, then prompt for login """
+        until = time() + seconds
+        while time() < until:
+            # boot messages, some with prompt-like text in them
+            self.send('Mounting /dev/da0s1a: 100% done\n'
+                      'kern.securelevel: -1 -> 1 #\n')
+            sleep(min(0.5, max(0, until - time())))
+        with self._lock:
+            self.state = 'login'
+            self._rxbuf = ''
+            self._prompt()
+
+    def _rpc_get_software_information(self, rest):
+        return _SOFTWARE.format(hostname=self.hostname,
+                                model_lc=self.model.lower())
+
+    def _rpc_get_system_information(self, rest):
+        return '<system-information>\n<hardware-model>{0}</hardware-model>\n' \
+            '<serial-number>{1}</serial-number>\n<host-name>{2}</host-name>\n' \
+            '</system-information>'.format(self.model.lower(), self.serial,
+                                          self.hostname)
+
+    def _rpc_get_chassis_inventory(self, rest):
+        modules = '\n'.join(_MODULE.format(n=n, model=self.model.split('-')[0])
+                            for n in range(self.modules))
+        return ('<chassis-inventory xmlns="http://xml.juniper.net/junos/'
+                '15.1R1/junos-chassis">\n<chassis junos:style="inventory">\n'
+                '<name>Chassis</name>\n<serial-number>{0}</serial-number>\n'
+                '<description>{1}</description>\n{2}\n</chassis>\n'
+                '</chassis-inventory>').format(self.serial, self.model, modules)
+
+    def _rpc_get_configuration(self, rest):
+        return '<configuration-text>\n{0}</configuration-text>'.format(
+            _CONFIG.format(hostname=self.hostname))
+
+    def _rpc_load_configuration(self, rest):
+        text = re.search(r'<configuration-text>(.*)</configuration-text>',
+                         rest, re.S)
+        if text is not None:
+            self.loaded.append(text.group(1).replace('&lt;', '<')
+                               .replace('&gt;', '>').replace('&amp;', '&'))
+        return '<load-configuration-results>\n<ok/>\n' \
+            '</load-configuration-results>'
+
+    def _rpc_commit_configuration(self, rest):
+        return '<commit-results>\n<routing-engine junos:style="normal">\n' \
+            '<name>re0</name>\n<commit-success/>\n</routing-engine>\n' \
+            '</commit-results>'
+
+    def _rpc_show_chassis_device_mode(self, rest):
+        return '<device-mode-information>\n' \
+            '<device-mode-current>Standalone</device-mode-current>\n' \
+            '<device-mode-after-reboot>Standalone</device-mode-after-reboot>\n' \
+            '</device-mode-information>'
+
+    def _rpc_get_interface_information(self, rest):
+        names = re.findall(r'<interface-name>([^<]*)</interface-name>', rest)
+        names = names or ['em0']
+        ifds = []
+        for name in names:
+            expand = [name.replace('*', str(n)) for n in range(2)] \
+                if '*' in name else [name]
+            ifds.extend(expand)
+        return '<interface-information>\n{0}\n</interface-information>'.format(
+            '\n'.join(_IFD.format(name=name, index=17 + n)
+                      for n, name in enumerate(ifds)))
+
+
+# =========================================================================
+# console transports
+# =========================================================================
+
+
+def _daemon(target, *args):
+    t = threading.Thread(target=target, args=args)
+    t.daemon = True
+    t.start()
+    return t
+
+
+def serve_pty(**kvargs):
+    """
+    serve one FakeJunos session on a pty pair, returns the slave path to
+    use as the netconify Serial port.  kvargs are given to FakeJunos.
+    """
+    master, slave = os.openpty()
+    dev = FakeJunos(lambda data: os.write(master, data), **kvargs)
+
+    def _serve():
+        while True:
+            try:
+                data = os.read(master, 4096)
+            except OSError:
+                return
+            if not data:
+                return
+            dev.feed(data)
+
+    _daemon(_serve)
+    return os.ttyname(slave)
+
+
+def _serve_socket(sock, kvargs):
+    dev = FakeJunos(sock.sendall, **kvargs)
+    while True:
+        try:
+            data = sock.recv(4096)
+        except socket.error:
+            return
+        if not data:
+            return
+        dev.feed(data)
+
+
+def _refuse(conn):
+    """ tell the client the port is busy, and hang up """
+    conn.sendall('\r\n% port already in use\r\n')
+    conn.shutdown(socket.SHUT_WR)
+    try:
+        while conn.recv(4096):
+            pass
+    except socket.error:
+        pass
+    conn.close()
+
+
+def serve_telnet(sessions=None, **kvargs):
+    """
+    listen for netconify Telnet sessions, each one a new FakeJunos.
+    returns the (host, port) to connect to.  kvargs are given to FakeJunos.
+
+    :sessions:
+      like a terminal server port, the sessions allowed at a time; any
+      more are told the port is in use and closed
+    """
+    srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    srv.bind(('127.0.0.1', 0))
+    srv.listen(64)
+    active = []
+
+    def _session(conn):
+        try:
+            _serve_socket(conn, kvargs)
+        finally:
+            active.remove(conn)
+            conn.close()
+
+    def _accept():
+        while True:
+            conn, addr = srv.accept()
+            if sessions is not None and len(active) >= sessions:
+                _daemon(_refuse, conn)
+                continue
+            active.append(conn)
+            _daemon(_session, conn)
+
+    _daemon(_accept)
+    return srv.getsockname()
+
+
+def serve_ssh(**kvargs):
+    """
+    listen for netconify SecureShell sessions; any user and password is
+    accepted and each shell or exec channel is a new FakeJunos.  returns
+    the (host, port) to connect to.  kvargs are given to FakeJunos.
+    """
+    import paramiko
+
+    host_key = paramiko.RSAKey.generate(2048)
+
+    class _Server(paramiko.ServerInterface):
+
+        def check_auth_password(self, username, password):
+            return paramiko.AUTH_SUCCESSFUL
+
+        def get_allowed_auths(self, username):
+            return 'password'
+
+        def check_channel_request(self, kind, chanid):
+            if kind == 'session':
+                return paramiko.OPEN_SUCCEEDED
+            return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+        def check_channel_pty_request(self, *args):
+            return True
+
+        def check_channel_shell_request(self, channel):
+            _daemon(_serve_socket, channel, kvargs)
+            return True
+
+        def check_channel_exec_request(self, channel, command):
+            _daemon(_serve_socket, channel, kvargs)
+            return True
+
+    srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    srv.bind(('127.0.0.1', 0))
+    srv.listen(64)
+
+    def _transport(conn):
+        t = paramiko.Transport(conn)
+        t.add_server_key(host_key)
+        t.start_server(server=_Server())
+
+    def _accept():
+        while True:
+            conn, addr = srv.accept()
+            _daemon(_transport, conn)
+
+    _daemon(_accept)
+    return srv.getsockname()
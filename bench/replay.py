@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+"""
+Replays a recorded session transcript (netconify --record) with no delays,
+to time the login state-machine, the NETCONF hello and the RPC reply
+parsing on real device output, without the device.
+
+With no transcript given, one is first recorded from the simulated
+device in fakejunos.py.
+
+usage: PYTHONPATH=lib python bench/replay.py [transcript] [count]
+"""
+import os
+import sys
+import tempfile
+from time import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fakejunos
+from netconify.tty_replay import Replay
+from netconify.tty_telnet import Telnet
+from netconify.transcript import Transcript
+
+
+def record(path):
+    """ record a login, facts and logout session from the fake device """
+    host, port = fakejunos.serve_telnet(modules=100)
+    tty = Telnet(host=host, port=port)
+    tty.transcript = Transcript(path, tty=tty.console)
+    tty.login()
+    tty.nc.facts.gather()
+    tty.logout()
+    tty.transcript.close()
+
+
+def replay(path):
+    tty = Replay(path, speed=0)
+    start = time()
+    tty.login()
+    login = time() - start
+    tty.nc.facts.gather()
+    tty.logout()
+    return login, time() - start
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        path = sys.argv[1]
+    else:
+        path = os.path.join(tempfile.mkdtemp(), 'fakejunos.jsonl')
+        record(path)
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    runs = [replay(path) for n in range(count)]
+    login = sorted(run[0] for run in runs)
+    total = sorted(run[1] for run in runs)
+    print "replay n={0} login median={1:.2f}ms session min={2:.2f}ms " \
+        "median={3:.2f}ms max={4:.2f}ms".format(
+            count, login[count // 2] * 1000, total[0] * 1000,
+            total[count // 2] * 1000, total[-1] * 1000)
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+"""
+Measures the Serial.read_prompt latency: the time from the device writing
+a prompt onto the console until read_prompt() returns it.
+
+A pty pair stands in for the console port; the 'device' side writes a
+login prompt each time it receives a line from netconify.  The previous
+sleep-and-readline polling loop is kept here as 'before' for comparison.
+
+usage: PYTHONPATH=lib python bench/serial_prompt.py [count]
+"""
+import os
+import sys
+import threading
+from time import time, sleep
+from datetime import datetime, timedelta
+
+from netconify.tty_serial import Serial
+
+_PROMPT = Serial._PROMPT
+
+PROMPT = 'Amnesiac (ttyu0)\r\n\r\nlogin: '
+
+
+def legacy_read_prompt(tty):
+    """ the read_prompt loop before the event-driven rework """
+    rxb = ''
+    mark_start = datetime.now()
+    mark_end = mark_start + timedelta(seconds=tty.EXPECT_TIMEOUT)
+
+    while datetime.now() < mark_end:
+        sleep(0.1)
+        line = tty._ser.readline()
+        if not line:
+            continue
+        rxb += line
+        found = _PROMPT.search(rxb)
+        if found is not None:
+            break
+    else:
+        return (None, None)
+
+    return (rxb, found.lastgroup)
+
+
+def device(master, marks, count):
+    """ answer every line received with a login prompt """
+    for n in range(count):
+        rx = ''
+        while not rx.endswith('\n'):
+            rx += os.read(master, 1024)
+        marks.append(time())
+        os.write(master, PROMPT)
+
+
+def measure(read_prompt, count):
+    master, slave = os.openpty()
+    tty = Serial(port=os.ttyname(slave))
+    tty._ser.open()
+
+    marks = []
+    dev = threading.Thread(target=device, args=(master, marks, count))
+    dev.daemon = True
+    dev.start()
+
+    latency = []
+    for n in range(count):
+        tty.write('')
+        text, found = read_prompt(tty)
+        assert found == 'login', found
+        latency.append(time() - marks[n])
+
+    tty._ser.close()
+    os.close(master)
+    os.close(slave)
+    return latency
+
+
+def report(name, latency):
+    latency = sorted(latency)
+    print "{0:8s} n={1} min={2:.1f}ms median={3:.1f}ms max={4:.1f}ms".format(
+        name, len(latency), latency[0] * 1000,
+        latency[len(latency) // 2] * 1000, latency[-1] * 1000)
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    report('before', measure(legacy_read_prompt, count))
+    report('after', measure(lambda tty: tty.read_prompt(), count))
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+"""
+Measures the startup cost of netconify: the time to import the package
+and the 'netconify' command module in a fresh interpreter, which of the
+heavy transport dependencies each import loads, and the time to create
+a netconifyCmdo, as a wrapper running many devices in one process does.
+
+usage: PYTHONPATH=lib python bench/startup.py [count]
+"""
+import os
+import sys
+import subprocess
+from time import time
+
+_HEAVY = ['serial', 'telnetlib', 'paramiko', 'cryptography']
+
+_IMPORTS = [
+    ('import netconify', 'import netconify'),
+    ('import cmdo', 'from netconify.cmdo import netconifyCmdo'),
+    ('telnet run', 'from netconify.cmdo import netconifyCmdo; '
+                   'import netconify; netconifyCmdo(); netconify.Telnet'),
+    ('ssh run', 'from netconify.cmdo import netconifyCmdo; '
+                'import netconify; netconifyCmdo(); netconify.SecureShell')
+]
+
+_TIMED = """
+import sys
+from time import time
+start = time()
+{0}
+print time() - start
+print ' '.join(m for m in {1!r} if m in sys.modules)
+"""
+
+
+def import_time(code):
+    """ run :code: in a new interpreter, return (seconds, heavy modules) """
+    out = subprocess.check_output(
+        [sys.executable, '-c', _TIMED.format(code, _HEAVY)],
+        stderr=open(os.devnull, 'w'))
+    seconds, modules = out.split('\n')[:2]
+    return float(seconds), modules
+
+
+def create_time(count):
+    """ the seconds to create one netconifyCmdo, averaged over :count: """
+    from netconify.cmdo import netconifyCmdo
+    netconifyCmdo()
+    start = time()
+    for n in range(count):
+        netconifyCmdo()
+    return (time() - start) / count
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+
+    for name, code in _IMPORTS:
+        runs = [import_time(code) for n in range(count)]
+        seconds = sorted(run[0] for run in runs)
+        print "{0:<16} n={1} median={2:.1f}ms loads: {3}".format(
+            name, count, seconds[count // 2] * 1000, runs[0][1] or '-')
+
+    print "netconifyCmdo()  n=1000 mean={0:.1f}us".format(
+        create_time(1000) * 1e6)
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+"""
+Benchmarks the Serial, Telnet and SecureShell transports end-to-end
+against the simulated Junos console in fakejunos.py:
+
+    login     tty open, login state-machine and NETCONF hello
+    rtt       get-software-information round trip, median of [count]
+    scaling   get-chassis-inventory time and peak RSS growth as the
+              reply grows with the number of FPC modules
+    logout    NETCONF close and logout state-machine
+
+usage: PYTHONPATH=lib python bench/suite.py [options]
+
+  --transport serial,telnet,ssh   transports to measure, default all
+  --rate N                        device line rate in bytes/s; 960 is a
+                                  9600 baud console, default no limit
+  --count N                       round trips for the rtt, default 20
+  --modules N,N,...               inventory sizes, default 10,100,1000
+"""
+import os
+import sys
+import argparse
+import resource
+from time import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fakejunos
+from netconify.tty_serial import Serial
+from netconify.tty_telnet import Telnet
+from netconify.tty_ssh import SecureShell
+
+TRANSPORTS = ['serial', 'telnet', 'ssh']
+
+
+def connect(transport, **kvargs):
+    """ serve a fresh simulated device and return a Terminal for it """
+    if transport == 'serial':
+        return Serial(port=fakejunos.serve_pty(**kvargs))
+    host, port = (fakejunos.serve_telnet if transport == 'telnet'
+                  else fakejunos.serve_ssh)(**kvargs)
+    if transport == 'telnet':
+        return Telnet(host=host, port=port)
+    return SecureShell(host=host, port=port, s_user='bench', s_passwd='bench')
+
+
+def maxrss():
+    """ peak resident set size of this process, in kB """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def timed(fn, *args):
+    start = time()
+    fn(*args)
+    return time() - start
+
+
+def bench(transport, args):
+    tty = connect(transport, rate=args.rate)
+    login = timed(tty.login)
+
+    rtt = sorted(timed(tty.nc.rpc, 'get-software-information')
+                 for n in range(args.count))
+    logout = timed(tty.logout)
+
+    print "{0:7s} login={1:.1f}ms rtt min={2:.1f}ms median={3:.1f}ms " \
+        "max={4:.1f}ms logout={5:.1f}ms".format(
+            transport, login * 1000, rtt[0] * 1000,
+            rtt[len(rtt) // 2] * 1000, rtt[-1] * 1000, logout * 1000)
+
+    for modules in args.modules:
+        tty = connect(transport, rate=args.rate, modules=modules)
+        tty.login()
+        rss = maxrss()
+        elapsed = timed(tty.nc.rpc, 'get-chassis-inventory')
+        print "{0:7s} inventory modules={1:<5d} {2:.1f}ms " \
+            "maxrss +{3}kB".format(transport, modules, elapsed * 1000,
+                                   maxrss() - rss)
+        tty.logout()
+
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser(description='netconify transport benchmarks')
+    p.add_argument('--transport', default=','.join(TRANSPORTS))
+    p.add_argument('--rate', type=int)
+    p.add_argument('--count', type=int, default=20)
+    p.add_argument('--modules', default='10,100,1000')
+    args = p.parse_args()
+    args.modules = [int(n) for n in args.modules.split(',')]
+
+    for transport in args.transport.split(','):
+        bench(transport, args)
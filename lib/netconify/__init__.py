@@ -1,8 +1,43 @@
-from netconify.tty_serial import Serial
-from netconify.tty_telnet import Telnet
-from netconify.tty_ssh import SecureShell
+import sys
+import types
+
 from netconify import constants as C
 
 __version__ = C.version
 __date__ = C.date
 __author__ = C.author
+
+# the console transports are imported on first use, e.g. netconify.Telnet,
+# so that a telnet session does not load pyserial or paramiko/cryptography
+_TRANSPORTS = {
+    'Serial': 'netconify.tty_serial',
+    'Telnet': 'netconify.tty_telnet',
+    'SecureShell': 'netconify.tty_ssh',
+    'Replay': 'netconify.tty_replay'
+}
+
+__all__ = ['C'] + sorted(_TRANSPORTS)
+
+
+class _Package(types.ModuleType):
+
+    """ the 'netconify' package module, importing the transports lazily """
+
+    def __getattr__(self, name):
+        if name not in _TRANSPORTS:
+            raise AttributeError(
+                "'module' object has no attribute '{0}'".format(name))
+        # __import__ with a fromlist, importlib is not in Python 2.6
+        module = __import__(_TRANSPORTS[name], fromlist=[name])
+        value = getattr(module, name)
+        setattr(self, name, value)
+        return value
+
+    def __dir__(self):
+        return sorted(set(self.__dict__) | set(_TRANSPORTS))
+
+_package = _Package(__name__, __doc__)
+_package.__dict__.update(globals())
+# keep this module object alive, its functions and classes use its globals
+_package._module = sys.modules[__name__]
+sys.modules[__name__] = _package
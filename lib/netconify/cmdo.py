@@ -6,9 +6,13 @@ import os
 import sys
 import json
 import re
+import gzip
 import argparse
 import logging
+import tempfile
+import threading
 import traceback
+from time import time
 from ConfigParser import SafeConfigParser
 from getpass import getpass
 from lxml import etree
@@ -16,6 +20,11 @@ import traceback
 
 import netconify
 import netconify.constants as C
+from netconify import confdiff
+from netconify.facts_cache import FactsCache
+from netconify.metrics import Metrics, Timing
+from netconify.events import EventStream
+from netconify.transcript import Transcript
 
 # only export the netconifyCmdo class definition
 __all__ = ['netconifyCmdo']
@@ -23,8 +32,14 @@ __all__ = ['netconifyCmdo']
 QFX_MODEL_LIST = ['QFX3500', 'QFX3600', 'VIRTUAL CHASSIS']
 QFX_MODE_NODE = 'NODE'
 QFX_MODE_SWITCH = 'SWITCH'
+WORKFLOW_STAGES = ['zeroize', 'reboot', 'wait-login', 'conf', 'facts',
+                   'qfx-node', 'qfx-switch']
 verbose = 0
 
+# the arguments parser is built once per class, and shared by its instances
+_argsparsers = {}
+_argsparsers_lock = threading.Lock()
+
 
 class netconifyCmdo(object):
 
@@ -36,6 +51,18 @@ class netconifyCmdo(object):
         """
         kvargs['notify']
           event notify callback
+
+        kvargs['metrics']
+          Metrics shared with other runs, e.g. by the fleet; the session
+          timings are then collected and notified as 'timing' events
+
+        kvargs['events']
+          EventStream shared with other runs, e.g. by the fleet; the
+          events are then written to it as JSON lines
+
+        kvargs['retry_open']
+          attempts to open a telnet console port, e.g. 1 for the fleet,
+          whose scheduler backs off and retries the device itself
         """
 
         #
@@ -44,12 +71,21 @@ class netconifyCmdo(object):
         self._name = None
         self._tty = None
         self._skip_logout = False
+        self._facts_cache = None
+        self._inventory_tmp = None
         self.on_notify = kvargs.get('notify', None)
+        self.metrics = kvargs.get('metrics', None)
+        self._events = kvargs.get('events', None)
+        self._retry_open = kvargs.get('retry_open', None)
 
         #
         # do stuff in the constructor
         #
-        self._init_argsparser()
+        with _argsparsers_lock:
+            self._argsparser = _argsparsers.get(type(self))
+            if self._argsparser is None:
+                self._init_argsparser()
+                _argsparsers[type(self)] = self._argsparser
 
         #
         # public attributes
@@ -79,6 +115,9 @@ class netconifyCmdo(object):
                        type=int, default=0,
                        help="increase verbose levevel: 0 = default, 1 = login debug, 2 = rpc reply debug")
 
+        p.add_argument('--events',
+                       help="write the events as JSON lines to this file, '-' for stdout")
+
         # ---------------------------------------------------------------------
         # Device level options
         # ---------------------------------------------------------------------
@@ -94,6 +133,16 @@ class netconifyCmdo(object):
                        help='load-merge conf file, default is overwrite',
                        action='store_true')
 
+        g.add_argument("--delta",
+                       dest='junos_conf_delta',
+                       help='load only the conf file hierarchies that differ from the device',
+                       action='store_true')
+
+        g.add_argument("--compress",
+                       dest='junos_conf_compress',
+                       help='send conf file gzip compressed, needs a shell login',
+                       action='store_true')
+
         g.add_argument('--qfx-node',
                        dest='qfx_mode',
                        action='store_const', const=QFX_MODE_NODE,
@@ -128,6 +177,11 @@ class netconifyCmdo(object):
                        action='store_true',
                        help='Disable cluster mode on SRX device and reboot')
 
+        g.add_argument('--workflow',
+                       dest='workflow',
+                       help='stage,... run in order in one console session: '
+                       '{0}'.format(', '.join(WORKFLOW_STAGES)))
+
         # ---------------------------------------------------------------------
         # directories
         # ---------------------------------------------------------------------
@@ -142,6 +196,20 @@ class netconifyCmdo(object):
                        action='store_true',
                        help="Do not save facts and inventory files")
 
+        g.add_argument('--save-inventory',
+                       choices=['pretty', 'raw', 'gzip'], default='pretty',
+                       help="inventory file as pretty-printed XML (default), or the reply as received, raw or gzip compressed")
+
+        g.add_argument('--facts-cache',
+                       help="Facts cache file, reused across runs")
+
+        g.add_argument('--facts-cache-ttl',
+                       type=float, default=3600,
+                       help="Facts cache entry lifetime (s)")
+
+        g.add_argument('--metrics',
+                       help="Save the session timings to this file, *.prom for Prometheus text, JSON otherwise")
+
         # ---------------------------------------------------------------------
         # console port
         # ---------------------------------------------------------------------
@@ -154,15 +222,37 @@ class netconifyCmdo(object):
 
         g.add_argument('-b', '--baud',
                        default='9600',
-                       help="serial port baud rate")
+                       help="serial port baud rate, or 'auto' to detect it")
+
+        g.add_argument('--baud-upgrade',
+                       type=int,
+                       help="switch the console to this baud rate once logged in")
+
+        g.add_argument('--flow',
+                       choices=['xonxoff', 'rtscts'],
+                       help="serial port flow control")
 
         g.add_argument('-t', '--telnet',
                        help='terminal server, <host>,<port>')
 
+        g.add_argument('--write-rate',
+                       type=int,
+                       help='limit configuration transfers to bytes/s')
+
         g.add_argument('--timeout',
                        default='0.5',
                        help='TTY connection timeout (s)')
 
+        g.add_argument('--record',
+                       help='record the console session transcript to this file')
+
+        g.add_argument('--replay',
+                       help='replay a recorded transcript instead of a console')
+
+        g.add_argument('--replay-speed',
+                       type=float, default=1.0,
+                       help='replay speed factor, 0 for no delays')
+
         # ---------------------------------------------------------------------
         # login configuration
         # ---------------------------------------------------------------------
@@ -189,6 +279,38 @@ class netconifyCmdo(object):
         g.add_argument('-s', '--ssh',
                        help='ssh server, <host>,<port>,<user>,<password>')
 
+        g.add_argument('--ssh-channel',
+                       help='command on the ssh server that attaches to the console port')
+
+        # ---------------------------------------------------------------------
+        # fleet mode
+        # ---------------------------------------------------------------------
+
+        g = p.add_argument_group('FLEET options')
+
+        g.add_argument('--inventory',
+                       help='JSON file of console endpoints to run in parallel')
+
+        g.add_argument('--workers',
+                       type=int, default=16,
+                       help='number of consoles driven in parallel')
+
+        g.add_argument('--gevent',
+                       action='store_true',
+                       help='drive the fleet consoles with gevent greenlets')
+
+        g.add_argument('--processes',
+                       action='store_true',
+                       help='drive each fleet console from its own process')
+
+        g.add_argument('--device-timeout',
+                       type=float,
+                       help='with --processes, fail a device not done after this many seconds')
+
+        g.add_argument('--server-limit',
+                       type=int,
+                       help='sessions allowed at the same time per console server or hub')
+
     # -------------------------------------------------------------------------
     # run command, can be involved from SHELL or programmatically
     # -------------------------------------------------------------------------
@@ -199,6 +321,7 @@ class netconifyCmdo(object):
         # parse command arguments
         # ------------------------
 
+        argv = args
         try:
             # parse command arguments
             self._args = self._argsparser.parse_args(args)
@@ -208,6 +331,14 @@ class netconifyCmdo(object):
 
         args = self._args  # alias
 
+        # ---------------------------------------------------------------
+        # fleet mode, each device in the inventory is run in parallel
+        # using the remaining command arguments
+        # ---------------------------------------------------------------
+
+        if args.inventory is not None:
+            return self._run_fleet(sys.argv[1:] if argv is None else argv)
+
         # ---------------------------------------------------------------
         # validate device hostname or IP address
         # ---------------------------------------------------------------
@@ -235,14 +366,74 @@ class netconifyCmdo(object):
         # validate command options before going through the LOGIN process
         # ---------------------------------------------------------------
 
-        fname = args.junos_conf_file
+        if args.facts_cache is not None:
+            self._facts_cache = FactsCache(args.facts_cache,
+                                           ttl=args.facts_cache_ttl)
+
+        if args.metrics is not None and self.metrics is None:
+            self.metrics = Metrics()
+
+        own_events = args.events is not None and self._events is None
+        if own_events is True:
+            self._events = EventStream(args.events)
+
+        completed = False
+        try:
+            if self._check_args() is False:
+                return self.results
+            results = self._run_session()
+            completed = True
+            return results
+        finally:
+            # the timings are saved even when the run failed part way
+            if args.metrics is not None:
+                self.metrics.save(args.metrics)
+            if self._inventory_tmp is not None:
+                os.remove(self._inventory_close())
+            if self._tty is not None and self._tty.transcript is not None:
+                self._tty.transcript.close()
+            if self._events is not None:
+                failed = self.results['failed'] or completed is False
+                self._events.emit('result', device=self._device,
+                                  result=('ok', 'failed')[failed],
+                                  changed=self.results['changed'],
+                                  errmsg=self.results['errmsg'])
+                if own_events is True:
+                    self._events.close()
+
+    def _check_args(self):
+        """ check the options that the LOGIN does not, False on error """
+        fname = self._args.junos_conf_file
         if fname is not None:
             if os.path.isfile(fname) is False:
                 self.results['failed'] = True
                 self.results[
                     'errmsg'] = 'ERROR: unknown file: {0}'.format(fname)
-                return self.results
+                return False
 
+        if self._args.workflow is not None:
+            stages = self._args.workflow.split(',')
+            unknown = [stage for stage in stages
+                       if stage not in WORKFLOW_STAGES]
+            if unknown:
+                self.results['failed'] = True
+                self.results['errmsg'] = 'ERROR: unknown workflow stage: ' \
+                    '{0}'.format(','.join(unknown))
+                return False
+            for stage, then in zip(stages, stages[1:]):
+                if stage in ('zeroize', 'reboot') and then != 'wait-login':
+                    self.results['failed'] = True
+                    self.results['errmsg'] = 'ERROR: workflow stage ' \
+                        '{0} must be followed by wait-login'.format(stage)
+                    return False
+            if 'conf' in stages and fname is None:
+                self.results['failed'] = True
+                self.results['errmsg'] = 'ERROR: workflow stage conf ' \
+                    'needs a Junos configuration file'
+                return False
+        return True
+
+    def _run_session(self):
         # --------------------
         # login to the CONSOLE
         # --------------------
@@ -284,23 +475,134 @@ class netconifyCmdo(object):
 
         return self.results
 
+    # -------------------------------------------------------------------------
+    # FLEET mode
+    # -------------------------------------------------------------------------
+
+    _FLEET_OPTS = ['--inventory', '--workers', '--metrics', '--events',
+                   '--device-timeout', '--server-limit', '--record']
+    _FLEET_FLAGS = ['--gevent', '--processes']
+
+    def _run_fleet(self, argv):
+        """ run every device in the inventory, return the combined results """
+        from netconify.fleet import netconifyFleet
+
+        if self._args.replay is not None:
+            self.results['failed'] = True
+            self.results['errmsg'] = 'ERROR: --replay is for a single ' \
+                'device, not an --inventory'
+            return self.results
+
+        # strip the fleet options, the rest is common to every device
+        common = []
+        skip = False
+        for arg in argv:
+            if skip is True:
+                skip = False
+            elif arg in self._FLEET_OPTS:
+                skip = True
+            elif arg in self._FLEET_FLAGS:
+                continue
+            elif arg.split('=')[0] not in self._FLEET_OPTS:
+                common.append(arg)
+
+        notify = None
+        if self.on_notify is not None:
+            notify = lambda name, event, message: self.on_notify(
+                self, '{0}:{1}'.format(name, event), message)
+
+        # one Metrics and EventStream for the fleet, so the timings are
+        # aggregated and the events of every device are in one stream
+        if self._args.metrics is not None and self.metrics is None:
+            self.metrics = Metrics()
+        own_events = self._args.events is not None and self._events is None
+        if own_events is True:
+            self._events = EventStream(self._args.events)
+
+        mode = 'thread'
+        if self._args.gevent is True:
+            mode = 'gevent'
+        elif self._args.processes is True:
+            mode = 'process'
+
+        try:
+            fleet = netconifyFleet(self._args.inventory, args=common,
+                                   workers=self._args.workers, notify=notify,
+                                   mode=mode,
+                                   timeout=self._args.device_timeout,
+                                   limit=self._args.server_limit,
+                                   metrics=self.metrics, events=self._events,
+                                   record=self._args.record)
+            devices = fleet.run()
+        except ValueError as err:
+            # e.g. duplicate device names in the inventory
+            self.results['failed'] = True
+            self.results['errmsg'] = 'ERROR: {0}'.format(err)
+            return self.results
+        finally:
+            if self._args.metrics is not None:
+                self.metrics.save(self._args.metrics)
+            if own_events is True:
+                self._events.close()
+
+        failed = sorted(name for name, rc in devices.items() if rc['failed'])
+        self.results['devices'] = devices
+        self.results['changed'] = any(rc['changed'] for rc in devices.values())
+        if failed:
+            self.results['failed'] = True
+            self.results['errmsg'] = 'failed devices: {0}'.format(
+                ', '.join(failed))
+        return self.results
+
     # -------------------------------------------------------------------------
     # Handlers
     # -------------------------------------------------------------------------
 
     def _hook_exception(self, event, err):
         self._notify("ERROR", "{0}:{1}\n".format(event, str(err)))
+        # kept in the results, e.g. for the 'result' event
+        self.results['failed'] = True
+        if self.results['errmsg'] is None:
+            self.results['errmsg'] = "{0}:{1}".format(event, str(err))
         raise
 
     def _tty_notifier(self, tty, event, message):
         self._notify("{0}".format(event), message)
 
     def _notify(self, event, message):
+        if self._events is not None:
+            self._emit(event, message)
         if self.on_notify is not None:
             self.on_notify(self, event, message)
-        elif self.on_notify is not False:
+        elif self.on_notify is not False and self._events is None:
             print "{0}:{1}".format(event, message)
 
+    @property
+    def _device(self):
+        """ the device name, or its console when no name is given """
+        if self._name is not None:
+            return self._name
+        if self._tty is not None:
+            return self._tty.console
+        return None
+
+    def _emit(self, event, message):
+        """ write the notify event to the JSON lines stream """
+        if isinstance(message, Timing):
+            fields = dict(message)
+            fields['duration'] = fields.pop('seconds')
+            fields.setdefault('phase',
+                              fields.pop('metric').replace('_seconds', ''))
+            fields.setdefault('device', self._device)
+            self._events.emit(event, **fields)
+        else:
+            self._events.emit(event, device=self._device,
+                              message=str(message).rstrip())
+
+    def _tty_tracer(self, tty, direction, data):
+        self._events.emit('trace', device=self._device,
+                          direction=direction, data=data)
+
     # -------------------------------------------------------------------------
     # LOGIN/LOGOUT
     # -------------------------------------------------------------------------
@@ -312,11 +614,23 @@ class netconifyCmdo(object):
         tty_args['passwd'] = self._args.passwd
         tty_args['timeout'] = float(self._args.timeout)
         tty_args['attempts'] = int(self._args.attempts)
-
-        if self._args.telnet is not None:
+        tty_args['write_rate'] = self._args.write_rate
+        tty_args['metrics'] = self.metrics
+        tty_args['timing'] = self.metrics is not None or \
+            self._events is not None
+        if self._events is not None:
+            tty_args['tracer'] = self._tty_tracer
+
+        if self._args.replay is not None:
+            self.console = ('replay', self._args.replay)
+            self._tty = netconify.Replay(self._args.replay,
+                                         speed=self._args.replay_speed,
+                                         **tty_args)
+        elif self._args.telnet is not None:
             host, port = re.split('[,:]', self._args.telnet)
             tty_args['host'] = host
             tty_args['port'] = port
+            tty_args['retry_open'] = self._retry_open
             self.console = ('telnet', host, port)
             self._tty = netconify.Telnet(**tty_args)
         elif self._args.ssh is not None:
@@ -325,15 +639,24 @@ class netconifyCmdo(object):
             tty_args['port'] = port
             tty_args['s_user'] = s_user or self._args.user
             tty_args['s_passwd'] = s_passwd or self._args.passwd
+            tty_args['channel'] = self._args.ssh_channel
             self.console = ('ssh', host, port, s_user, s_passwd)
             self._tty = netconify.SecureShell(**tty_args)
         else:
             tty_args['port'] = self._args.port
             tty_args['baud'] = self._args.baud
+            tty_args['baud_upgrade'] = self._args.baud_upgrade
+            tty_args['flow'] = self._args.flow
             self.console = ('serial', self._args.port)
             self._tty = netconify.Serial(**tty_args)
 
+        if self._args.record is not None:
+            self._tty.transcript = Transcript(self._args.record,
+                                              tty=self._tty.console)
+
         notify = self.on_notify or self._tty_notifier
+        if self._events is not None:
+            notify = self._tty_notifier     # through the event stream
         self._tty.login(notify=notify)
 
     def _tty_logout(self):
@@ -345,6 +668,10 @@ class netconifyCmdo(object):
     def _do_actions(self):
         args = self._args  # alias
 
+        if args.workflow is not None:
+            self._workflow()
+            return
+
         if args.request_srx_cluster is not None:
             self._srx_cluster()
             return
@@ -371,6 +698,11 @@ class netconifyCmdo(object):
         if args.qfx_mode is not None:
             self._qfx_mode()
 
+    def _invalidate_facts(self):
+        """ drop the cached facts once the device has been changed """
+        if self._facts_cache is not None:
+            self._facts_cache.invalidate(':'.join(self.console[:3]))
+
     def _srx_cluster(self):
         """ Enable cluster mode on SRX device"""
         srx_args = {}
@@ -397,6 +729,7 @@ class netconifyCmdo(object):
         """ perform device ZEROIZE actions """
         self._notify('zeroize', 'ZEROIZE device, rebooting')
         self._tty.nc.zeroize()
+        self._invalidate_facts()
         self._skip_logout = True
         self.results['changed'] = True
 
@@ -411,6 +744,75 @@ class netconifyCmdo(object):
         self._skip_logout = True
         self.results['changed'] = True
 
+    # -------------------------------------------------------------------------
+    # WORKFLOW of several stages in one console session
+    # -------------------------------------------------------------------------
+
+    def _workflow(self):
+        """
+        run the --workflow stages in order on the one console session.  a
+        stage that reboots the device is followed by 'wait-login', which
+        logs in again once the device is back, rather than opening the
+        console again.  each stage is timed, and the timings returned in
+        the results as 'workflow'.
+        """
+        stages = self._args.workflow.split(',')
+        self.results['workflow'] = []
+        for n, stage in enumerate(stages):
+            if self._skip_logout is True and stage != 'wait-login':
+                # e.g. a QFX mode change rebooted the device
+                self.results['failed'] = True
+                self.results['errmsg'] = 'the device is rebooting, ' \
+                    'wait-login before {0}'.format(stage)
+                self._notify('workflow', self.results['errmsg'])
+                return
+            self._notify('workflow', 'stage {0}/{1}: {2}'.format(
+                n + 1, len(stages), stage))
+            started = time()
+            getattr(self, '_stage_' + stage.replace('-', '_'))()
+            elapsed = self._tty._timing('stage_seconds', started, stage=stage)
+            self.results['workflow'].append(dict(stage=stage,
+                                                 seconds=round(elapsed, 3)))
+            if self.results['failed'] is True:
+                self._notify('workflow', 'stage {0} failed, stopping'.format(
+                    stage))
+                return
+            self._notify('workflow', 'stage {0} done in {1:.1f}s'.format(
+                stage, elapsed))
+
+    def _stage_zeroize(self):
+        self._zeroize()
+
+    def _stage_reboot(self):
+        self._notify('shutdown', 'shutdown reboot')
+        self._tty.nc.reboot()
+        self._skip_logout = True
+        self.results['changed'] = True
+
+    def _stage_wait_login(self):
+        if self._skip_logout is False:
+            self._notify('workflow', 'the device is not rebooting')
+            return
+        self._tty.relogin()
+        self._skip_logout = False
+        self.facts = None           # gathered again after the reboot
+
+    def _stage_conf(self):
+        self._push_config()
+
+    def _stage_facts(self):
+        self._gather_facts()
+        self._save_facts_json()
+        self._save_inventory_xml()
+
+    def _stage_qfx_node(self):
+        self._args.qfx_mode = QFX_MODE_NODE
+        self._qfx_mode()
+
+    def _stage_qfx_switch(self):
+        self._args.qfx_mode = QFX_MODE_SWITCH
+        self._qfx_mode()
+
     def _save_facts_json(self):
         if self._args.no_save is True:
             self._notify('facts', '{0}'.format(self.facts))
@@ -428,6 +830,9 @@ class netconifyCmdo(object):
     def _save_inventory_xml(self):
         if self._args.no_save is True:
             return
+        if self._args.save_inventory != 'pretty':
+            self._save_inventory_raw()
+            return
         if not hasattr(self._tty.nc.facts, 'inventory'):
             return
 
@@ -439,21 +844,80 @@ class netconifyCmdo(object):
         with open(path, 'w+') as f:
             f.write(as_xml)
 
-    def _gather_facts(self):
+    def _save_inventory_raw(self):
+        """ move the streamed inventory reply in place, once per gather """
+        if self._inventory_tmp is None:
+            return
+        tmp = self._inventory_close()
+        if not hasattr(self._tty.nc.facts, 'inventory'):
+            os.remove(tmp)
+            return
+
+        fname = self._save_name + '-inventory.xml'
+        if self._args.save_inventory == 'gzip':
+            fname += '.gz'
+        path = os.path.join(self._args.savedir, fname)
+        self._notify('inventory', 'saving: {0}'.format(path))
+        os.rename(tmp, path)
+
+    def _inventory_sink(self):
+        """
+        with --save-inventory raw or gzip, return the file the inventory
+        reply is streamed to as it is received: a temporary file in the
+        SAVEDIR, since the file name depends on the facts
+        """
+        if self._args.no_save is True or \
+                self._args.save_inventory == 'pretty':
+            return None
+        fd, path = tempfile.mkstemp(prefix='.netconify-', suffix='.tmp',
+                                    dir=self._args.savedir)
+        files = [os.fdopen(fd, 'wb')]
+        if self._args.save_inventory == 'gzip':
+            files.insert(0, gzip.GzipFile(fileobj=files[0], mode='wb'))
+        self._inventory_tmp = (path, files)
+        return files[0]
+
+    def _inventory_close(self):
+        """ close the streamed inventory file, return its path """
+        path, files = self._inventory_tmp
+        self._inventory_tmp = None
+        for f in files:
+            f.close()
+        return path
+
+    def _gather_facts(self, *cmds):
+        """ gather the facts, any :cmds: RPC replies are returned """
         self._notify('facts', 'retrieving device facts...')
-        self._tty.nc.facts.gather()
+        rsps = self._tty.nc.facts.gather(*cmds, cache=self._facts_cache,
+                                         console=':'.join(self.console[:3]),
+                                         inventory=self._inventory_sink())
         self.facts = self._tty.nc.facts.items
         self.results['facts'] = self.facts
         self._save_name = self._name or self.facts[
             'hostname'] or '_'.join(self.console)
+        return rsps
 
     def _push_config(self):
         """ push the configuration or rollback changes on error """
 
-        self._notify('conf', 'loading into device ...')
         content = open(self._args.junos_conf_file, 'r').read()
-        load_args = dict(content=content)
-        if self._args.junos_merge_conf is True:
+        merge = self._args.junos_merge_conf
+
+        if self._args.junos_conf_delta is True:
+            self._notify('conf', 'comparing to the running configuration ...')
+            content = confdiff.delta(self._tty.nc.get_config(), content,
+                                     merge=merge)
+            if not content:
+                self._notify('conf', 'no changes, nothing to commit.')
+                return
+            # loaded with action='replace': the 'replace:' and 'delete:'
+            # tags of an override apply, untagged statements are merged
+            merge = True
+
+        self._notify('conf', 'loading into device ...')
+        load_args = dict(content=content,
+                         compress=self._args.junos_conf_compress)
+        if merge is True:
             load_args['action'] = 'replace'  # merge/replace; yeah, I know ...
         rc = self._tty.nc.load(**load_args)
 
@@ -475,6 +939,7 @@ class netconifyCmdo(object):
             return
 
         self._notify('conf', 'commit completed.')
+        self._invalidate_facts()
         self.results['changed'] = True
         return
 
@@ -487,11 +952,12 @@ class netconifyCmdo(object):
 
         # ----------------------------------------------------
         # we need the facts, so if the caller didn't explicity
-        # request them, grab them now
+        # request them, grab them now along with the device mode
         # ----------------------------------------------------
 
+        mode = None
         if self.facts is None:
-            self._gather_facts()
+            mode, = self._gather_facts('show-chassis-device-mode')
         facts = self.facts  # alias
 
         # --------------------------------------------------------
@@ -510,7 +976,7 @@ class netconifyCmdo(object):
             self._notify('qfx', self.results['errmsg'])
             return
 
-        now, later = self._qfx_device_mode_get()
+        now, later = self._qfx_device_mode_get(mode)
         # compare to after-reoobt
         change = bool(later != self._args.qfx_mode)
         reboot = bool(now != self._args.qfx_mode)       # compare to now
@@ -541,6 +1007,7 @@ class netconifyCmdo(object):
                          'Changing the mode to: {0}'.format(self._args.qfx_mode))
             self.results['changed'] = True
             self._qfx_device_mode_set()
+            self._invalidate_facts()
 
         if reboot is True:
             self._notify('change', 'REBOOTING device now!')
@@ -571,10 +1038,10 @@ class netconifyCmdo(object):
         QFX_MODE_NODE: 'node-device'
     }
 
-    def _qfx_device_mode_get(self):
-        """ get the current device mode """
-        rpc = self._tty.nc.rpc
-        got = rpc('show-chassis-device-mode')
+    def _qfx_device_mode_get(self, got=None):
+        """ get the current device mode, unless already given :got: """
+        if got is None:
+            got = self._tty.nc.rpc('show-chassis-device-mode')
         now = got.findtext('device-mode-current')
         later = got.findtext('device-mode-after-reboot')
         return (self._QFX_MODES[now], self._QFX_MODES[later])
@@ -0,0 +1,112 @@
+"""
+Junos 'conf'-style text comparison, used to push only the top-level
+configuration hierarchies that differ from the running configuration.
+"""
+import re
+
+__all__ = ['stanzas', 'delta']
+
+_prefix = re.compile(r'^(?:(?:inactive|protect):\s*)+')
+
+
+def _unquoted(line):
+    """ yield (index, char) for each character of :line: not quoted """
+    quoted = False
+    escaped = False
+    for n, c in enumerate(line):
+        if escaped is True:
+            escaped = False
+        elif c == '\\' and quoted is True:
+            escaped = True
+        elif c == '"':
+            quoted = not quoted
+        elif quoted is False:
+            yield n, c
+
+
+def _strip(line):
+    """ the :line: without its '##' comment (outside quotes), stripped """
+    if line.lstrip().startswith('#'):
+        return ''
+    for n, c in _unquoted(line):
+        if c == '#' and line[n:n + 2] == '##':
+            return line[:n].strip()
+    return line.strip()
+
+
+def _lines(text):
+    """
+    the configuration lines without comments or blanks, as a tuple of
+    (<stripped line>, <original line>)
+    """
+    for line in text.splitlines():
+        stripped = _strip(line)
+        if stripped and not stripped.startswith('version '):
+            yield stripped, line.rstrip()
+
+
+def _braces(line):
+    """ net change in nesting depth for the line, ignoring quoted text """
+    depth = 0
+    for n, c in _unquoted(line):
+        if c == '{':
+            depth += 1
+        elif c == '}':
+            depth -= 1
+    return depth
+
+
+def _stanzas(text):
+    """ the top-level statements as (<name>, <normalized>, <original>) """
+    found = []
+    depth = 0
+    for line, original in _lines(text):
+        if depth == 0:
+            name = _prefix.sub('', line).split()[0].rstrip(';{')
+            found.append((name, [line], [original.lstrip()]))
+        else:
+            found[-1][1].append(line)
+            found[-1][2].append(original)
+        depth += _braces(line)
+    return [(name, '\n'.join(lines), '\n'.join(originals))
+            for name, lines, originals in found]
+
+
+def stanzas(text):
+    """
+    split the configuration :text: into its top-level statements.  returns
+    a list of tuple(<name>, <normalized text>) in the order found; the
+    <name> is the statement keyword, e.g. 'system' or 'apply-groups',
+    without any 'inactive:' or 'protect:' prefix
+    """
+    return [(name, lines) for name, lines, original in _stanzas(text)]
+
+
+def delta(running, candidate, merge=False):
+    """
+    compare the :candidate: configuration text to the :running: one, and
+    return the text to load with action='replace' that applies only the
+    difference: each new or changed top-level statement tagged 'replace:',
+    and each one missing from the candidate tagged 'delete:'.  when
+    :merge: is True, the new or changed statements are left untagged, so
+    they are merged into the running ones, and nothing is deleted.
+    the statements are compared without comments or indentation, but
+    pushed as written in the :candidate:.  returns an empty string when
+    nothing changed.
+    """
+    have = dict(stanzas(running))
+    want = _stanzas(candidate)
+
+    patch = []
+    for name, text, original in want:
+        if have.get(name) != text:
+            patch.append(original if merge is True
+                         else 'replace: ' + original)
+
+    if merge is False:
+        names = set(name for name, text, original in want)
+        for name, text in stanzas(running):
+            if name not in names:
+                patch.append('delete: {0};'.format(name))
+
+    return '\n'.join(patch) + '\n' if patch else ''
@@ -0,0 +1,66 @@
+"""
+This file defines the 'EventStream' class.
+Used to write the netconify events as JSON lines for other tools.
+"""
+import sys
+import json
+import threading
+from time import time
+from Queue import Queue, Empty
+
+__all__ = ['EventStream']
+
+
+class EventStream(object):
+
+    """
+    Writes one JSON object per event, one per line, to a file or stdout.
+    emit() only queues the event, a background thread does the writing in
+    batches, so a slow disk or reader never holds up the console I/O.  One
+    EventStream may be shared by several devices, e.g. in fleet mode.
+    """
+
+    def __init__(self, path):
+        """
+        :path:
+          the file the events are appended to, '-' for stdout
+        """
+        if path == '-':
+            self._out = sys.stdout
+        else:
+            self._out = open(path, 'a')
+        self._queue = Queue()
+        self._thread = threading.Thread(target=self._writer)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def emit(self, event, **fields):
+        """ queue the :event: with :fields:, time-stamped now """
+        fields['event'] = event
+        fields.setdefault('time', time())
+        self._queue.put(fields)
+
+    def close(self):
+        """ write out the queued events and close the stream """
+        self._queue.put(None)
+        self._thread.join()
+        if self._out is not sys.stdout:
+            self._out.close()
+
+    def _writer(self):
+        while True:
+            batch = [self._queue.get()]
+            try:
+                while batch[-1] is not None:
+                    batch.append(self._queue.get_nowait())
+            except Empty:
+                pass
+            done = batch[-1] is None
+            if done is True:
+                batch.pop()
+            if batch:
+                self._out.write(''.join(json.dumps(fields, default=str) + '\n'
+                                        for fields in batch))
+                self._out.flush()
+            if done is True:
+                return
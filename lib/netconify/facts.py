@@ -3,18 +3,84 @@ from lxml.builder import E
 from lxml import etree
 
 
+class _LazyFacts(dict):
+
+    """
+    facts dictionary that retrieves a missing fact on first access, running
+    only the RPC(s) it depends on; the value is then kept for the session.
+    iteration and 'in' only see the facts retrieved so far.
+    """
+
+    def __init__(self, facts):
+        dict.__init__(self)
+        self._facts = facts
+
+    def __missing__(self, key):
+        return self._facts._load(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+
+class _Tee(object):
+
+    """ file-like object that keeps a copy of what is written to :out: """
+
+    def __init__(self, out):
+        self._out = out
+        self.lines = []
+
+    def write(self, data):
+        self._out.write(data)
+        self.lines.append(data)
+
+
 class Facts(object):
 
+    # the RPC methods that provide each fact, tried in order; the 'model'
+    # comes from the chassis inventory unless the device does not have one
+    # (QFX in 'node' mode), then from the software information
+    _LOADERS = {
+        'version': ('version',),
+        'hostname': ('version',),
+        'models': ('version',),
+        'model': ('chassis', 'version'),
+        'serialnumber': ('chassis',)
+    }
+
+    # the chassis modules kept in the inventory when its reply is streamed
+    # to a file; the facts (and the QFX mode change) only use these
+    _INVENTORY_MODULES = ('Backplane', 'FPC 0')
+
     def __init__(self, parent):
         self.rpc = parent.rpc
-        self.facts = {}
+        self.rpcs = parent.rpcs
+        self.parse = parent.parse
+        self.facts = _LazyFacts(self)
+        self._loaded = set()
+        self._chassis_model = False
 
     @property
     def items(self):
         return self.facts
 
+    def _load(self, key):
+        """ run the RPC(s) for the fact :key:, unless already done """
+        for loader in self._LOADERS.get(key, ()):
+            if loader not in self._loaded:
+                getattr(self, loader)()
+            if key in self.facts:
+                return dict.__getitem__(self.facts, key)
+        raise KeyError(key)
+
     def version(self):
-        rsp = self.rpc('get-software-information')
+        self._version(self.rpc('get-software-information'))
+
+    def _version(self, rsp):
+        self._loaded.add('version')
         self.swinfo = rsp  # keep this since we may want it later
 
         # extract the version
@@ -34,27 +100,56 @@ class Facts(object):
         # extract the host-name
         self.facts['hostname'] = rsp.xpath('.//host-name')[0].text
 
-        # extract the product model/models
+        # extract the product model/models.  the model is only used when
+        # the chassis inventory does not provide one
         product_model = rsp.xpath('//product-model')
         num_models = len(product_model)
         if num_models == 0:
-            self.facts['model'] = None
+            self._sw_model = None
         elif num_models == 1:
-            self.facts['model'] = product_model[0].text.upper()
+            self._sw_model = product_model[0].text.upper()
         else:
             fpc = lambda m: m.xpath('../../re-name')[0].text
             self.facts['models'] = dict((fpc(m), m.text.upper()) for m in product_model)
+        self._model_fallback()
+
+    def _model_fallback(self):
+        """ use the software model when the chassis inventory has none """
+        if self._chassis_model is True or 'chassis' not in self._loaded:
+            return
+        if hasattr(self, '_sw_model'):
+            self.facts['model'] = self._sw_model
+
+    def chassis(self, sink=None):
+        """
+        :sink:
+          file the raw inventory reply is streamed to, the inventory is
+          then kept with only the modules the facts use
+        """
+        self._chassis(self.rpc('get-chassis-inventory',
+                               **self._inventory_receive(sink)))
+
+    def _inventory_receive(self, sink):
+        """ the _receive() kvargs to stream the inventory to :sink: """
+        if sink is None:
+            return {}
+        return dict(sink=sink, prune=self._inventory_prune)
 
-    def chassis(self):
+    def _inventory_prune(self, elem):
+        return elem.tag == 'chassis-module' and \
+            (elem.findtext('name') or '').strip() not in self._INVENTORY_MODULES
+
+    def _chassis(self, rsp):
+        self._loaded.add('chassis')
         try:
-            # try to get the chassis inventory. this will fail if the device
+            # try to use the chassis inventory. this will fail if the device
             # happens to be a QFX in 'node' mode, so use exception handling
-            rsp = self.rpc('get-chassis-inventory')
             # keep this since we want to save the data to file
             self.inventory = rsp
             chas = rsp.find('chassis')
             sn = chas.findtext('serial-number')
             self.facts['model'] = chas.findtext('description').upper()
+            self._chassis_model = True
 
             # use the chassis level serial number, and if that doesn't exist
             # look for the 'Backplane' serial number
@@ -66,7 +161,7 @@ class Facts(object):
             # the chassis-subsystem isn't running.  the hostname is the serial
             # nubmer
             self.facts['serialnumber'] = self.facts['hostname']
-            pass
+        self._model_fallback()
 
     def eth(self, ifname):
         cmd = E('get-interface-information',
@@ -74,18 +169,118 @@ class Facts(object):
                 E('interface-name', ifname))
 
         rsp = self.rpc(etree.tostring(cmd))[0]   # at physical-interface
-        facts = self.facts
+        self.facts[ifname] = self._eth(rsp)
+        return self.facts[ifname]
+
+    def eths(self, *ifnames):
+        """
+        the facts of several interfaces, each of :ifnames: may also be a
+        wildcard such as 'em*', 'me*' or 'fxp*'.  the RPCs, one per name,
+        are pipelined so they cost a single round trip, and every
+        physical-interface in the replies is set in facts[<name>].
+        returns a dict of the interfaces found, by name.
+        """
+        cmds = [etree.tostring(E('get-interface-information',
+                                 E.media(),
+                                 E('interface-name', ifname)))
+                for ifname in ifnames]
+        found = {}
+        for rsp in self.rpcs(cmds):
+            for ifd in rsp.findall('physical-interface'):
+                name = ifd.findtext('name').strip()
+                found[name] = self.facts[name] = self._eth(ifd)
+        return found
+
+    def _eth(self, ifd):
+        """ the facts of the physical-interface :ifd: """
+        return dict(macaddr=ifd.findtext('.//current-physical-address'),
+                    ifindex=ifd.findtext('snmp-index'),
+                    oper=ifd.findtext('oper-status'),
+                    admin=ifd.findtext('admin-status'),
+                    speed=ifd.findtext('speed'),
+                    duplex=ifd.findtext('duplex'))
 
-        facts[ifname] = {}
-        facts[ifname]['macaddr'] = rsp.findtext('.//current-physical-address')
-        facts[ifname]['ifindex'] = rsp.findtext('snmp-index')
-        facts[ifname]['oper'] = rsp.findtext('oper-status')
-        facts[ifname]['admin'] = rsp.findtext('admin-status')
-        facts[ifname]['speed'] = rsp.findtext('speed')
-        facts[ifname]['duplex'] = rsp.findtext('duplex')
+    def gather(self, *cmds, **kvargs):
+        """
+        gather the facts, pipelining the version and chassis RPCs.  any
+        additional :cmds: are pipelined along with them, and their replies
+        are returned as a list.
 
-        return facts[ifname]
+        kvargs['cache']
+          FactsCache; when it holds an entry for the console that matches
+          the version facts and the serial number, the chassis inventory
+          RPC is skipped.  with no entry for the console at all, it is
+          pipelined with the others
 
-    def gather(self):
-        self.version()
-        self.chassis()
+        kvargs['console']
+          the console endpoint name used as the cache key
+
+        kvargs['inventory']
+          file the raw chassis inventory reply is streamed to, rather than
+          kept whole in :inventory: (see chassis())
+        """
+        cache = kvargs.get('cache')
+        sink = kvargs.get('inventory')
+        if cache is None:
+            rsps = self.rpcs(['get-software-information',
+                              'get-chassis-inventory'] + list(cmds),
+                             receive={1: self._inventory_receive(sink)})
+            self._version(rsps[0])
+            self._chassis(rsps[1])
+            return rsps[2:]
+
+        # the system information has the serial number, so a cached entry
+        # is only used for the same device; older releases without this
+        # RPC have none, and the cache is then not used.  when nothing is
+        # cached for the console, a hit is not possible, so the chassis
+        # inventory is pipelined along as without a cache
+        console = kvargs.get('console')
+        if sink is not None:
+            sink = _Tee(sink)           # cache the raw reply, as streamed
+        head = ['get-software-information', 'get-system-information']
+        receive = {}
+        known = cache.known(console)
+        if known is False:
+            head.append('get-chassis-inventory')
+            receive[2] = self._inventory_receive(sink)
+        rsps = self.rpcs(head + list(cmds), receive=receive)
+        self._version(rsps[0])
+        serialnumber = rsps[1].findtext('serial-number')
+
+        if known is False:
+            self._chassis(rsps[2])
+            self._cache_store(cache, console, serialnumber, sink)
+            return rsps[3:]
+
+        entry = cache.lookup(console, self.facts, serialnumber)
+        if entry is None:
+            self.chassis(sink)
+            self._cache_store(cache, console, serialnumber, sink)
+            return rsps[2:]
+
+        self.facts.update(entry['facts'])
+        self._loaded.add('chassis')
+        self._chassis_model = 'model' in entry['facts']
+        inventory = entry['inventory']
+        if inventory is not None:
+            if sink is not None:
+                sink.write(inventory)
+                inventory = self.parse(inventory,
+                                       prune=self._inventory_prune)
+            else:
+                inventory = self.parse(inventory)
+            # a streamed inventory was cached as the raw reply
+            if inventory.tag == 'rpc-reply':
+                inventory = inventory[0]
+            self.inventory = inventory
+        return rsps[2:]
+
+    def _cache_store(self, cache, console, serialnumber, sink):
+        """ save the facts and inventory just gathered to the :cache: """
+        if sink is not None:
+            inventory = ''.join(sink.lines)
+        else:
+            inventory = getattr(self, 'inventory', None)
+            if inventory is not None:
+                inventory = etree.tostring(inventory)
+        cache.store(console, self.facts, inventory, serialnumber)
@@ -0,0 +1,138 @@
+"""
+This file defines the 'FactsCache' class.
+Used to keep device facts on disk between netconify runs.
+"""
+import os
+import json
+import tempfile
+import threading
+from contextlib import contextmanager
+from time import time
+
+try:
+    import fcntl
+except ImportError:     # not on Windows, only threads are serialized
+    fcntl = None
+
+__all__ = ['FactsCache']
+
+# serializes the read-modify-write of the cache file when several
+# devices share it, e.g. in fleet mode; the threads of one process with
+# this lock, and the processes (fleet --processes) with a lock file
+_lock = threading.Lock()
+
+
+class FactsCache(object):
+
+    """
+    On-disk JSON cache of device facts and chassis inventory, keyed by the
+    console endpoint and the device serial number.  An entry is only used
+    for the serial number the device reports on this run, when it is
+    younger than the TTL, and when the cheap version facts (hostname,
+    version) gathered on this run match the ones cached; the
+    get-chassis-inventory RPC can then be skipped.
+    """
+    TTL = 3600          # seconds a cache entry is valid
+
+    def __init__(self, path, ttl=None):
+        """
+        :path:
+          the cache file, created if it does not exist
+
+        :ttl:
+          seconds a cache entry is valid, defaults to :TTL:
+        """
+        self.path = path
+        self.ttl = self.TTL if ttl is None else float(ttl)
+
+    # -------------------------------------------------------------------------
+    # cache file I/O
+    # -------------------------------------------------------------------------
+
+    @contextmanager
+    def _locked(self):
+        """ hold the cache file, against other threads and processes """
+        with _lock:
+            if fcntl is None:
+                yield
+                return
+            with open(self.path + '.lock', 'a') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _load(self):
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def _save(self, entries):
+        fd, tmp = tempfile.mkstemp(prefix='.facts-cache-', suffix='.tmp',
+                                   dir=os.path.dirname(self.path) or '.')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(entries, f)
+        os.rename(tmp, self.path)
+
+    # -------------------------------------------------------------------------
+    # cache operations
+    # -------------------------------------------------------------------------
+
+    def lookup(self, console, facts, serialnumber=None):
+        """
+        return the cache entry for :console: and the device :serialnumber:
+        that matches the version :facts: just gathered, or None.  the
+        entry is a dict with the 'facts' and the 'inventory' XML text.
+        without a :serialnumber: the device is not known, so None.
+        """
+        if not serialnumber:
+            return None
+        with self._locked():
+            entries = self._load()
+        entry = entries.get(self._key(console, serialnumber))
+        if entry is None or time() - entry['timestamp'] > self.ttl:
+            return None
+        cached = entry['facts']
+        if all(cached.get(k) == facts.get(k) for k in ('hostname', 'version')):
+            return entry
+        return None
+
+    def known(self, console):
+        """ True when there is an entry for :console: younger than the TTL """
+        with self._locked():
+            entries = self._load()
+        now = time()
+        return any(entry['console'] == console and
+                   now - entry['timestamp'] <= self.ttl
+                   for entry in entries.values())
+
+    @staticmethod
+    def _key(console, serialnumber):
+        return '{0}#{1}'.format(console, serialnumber)
+
+    def store(self, console, facts, inventory=None, serialnumber=None):
+        """
+        save the :facts: and :inventory: XML text for the :console: and
+        the device :serialnumber:, the one given to lookup().  without a
+        :serialnumber: the entry could never be found, so nothing is saved
+        """
+        if not serialnumber:
+            return
+        key = self._key(console, serialnumber)
+        with self._locked():
+            entries = self._load()
+            entries[key] = dict(console=console, facts=facts,
+                                inventory=inventory, timestamp=time())
+            self._save(entries)
+
+    def invalidate(self, console):
+        """ remove all of the entries for the :console: """
+        with self._locked():
+            entries = self._load()
+            keep = dict((k, v) for k, v in entries.items()
+                        if v['console'] != console)
+            if len(keep) != len(entries):
+                self._save(keep)
@@ -0,0 +1,412 @@
+"""
+This file defines the 'netconifyFleet' class.
+Used to bootstrap many consoles in parallel from one netconify run.
+"""
+import os
+import re
+import json
+import threading
+from time import time
+from select import select
+
+from netconify.cmdo import netconifyCmdo
+from netconify.metrics import Metrics
+from netconify.scheduler import Scheduler
+
+# only export the netconifyFleet class definition
+__all__ = ['netconifyFleet']
+
+# device inventory keys that map to netconify CONSOLE options
+_CONSOLE_OPTS = ['port', 'baud', 'telnet', 'ssh', 'ssh-channel']
+
+
+class netconifyFleet(object):
+
+    """
+    netconifyFleet drives a list of console endpoints through the same
+    login/actions/logout flow as the 'netconify' utility, using a bounded
+    pool of worker threads.  Each device is handled by its own
+    netconifyCmdo instance, so the per-device results are identical to
+    what a single 'netconify' run would return.
+
+    The inventory is a list of dicts (or the path to a JSON file holding
+    such a list), for example:
+
+        [
+          {"name": "sw1", "telnet": "ts1,7001", "args": ["--facts"]},
+          {"name": "sw2", "ssh": "ts2,3002,admin,secret",
+           "args": ["-f", "sw2.conf"]},
+          {"name": "sw3", "port": "/dev/ttyUSB3", "baud": "9600",
+           "hub": "hub1"}
+        ]
+
+    The devices are scheduled so that no more than :limit: sessions run
+    on one console server (the telnet/ssh host, or the "hub" given for a
+    serial port) at a time.  A device whose console port is in use or not
+    ready is retried after a jittered exponential backoff, and its slot
+    is given to the next device meanwhile.
+
+    With mode='gevent' each console is driven by a greenlet instead of an
+    OS thread, so a single event loop can hold several hundred Telnet and
+    SSH console sessions; the login state-machine and the NETCONF
+    operations run unchanged on top.  This requires gevent, and the
+    gevent.monkey.patch_all() call must be made *before* the console
+    transports are imported so that telnetlib and paramiko are loaded
+    cooperative.  'import netconify' does not import them; the first use
+    of netconify.Telnet or netconify.SecureShell does.
+
+    With mode='process' each console is driven by its own process, for
+    hosts with many USB serial ports where a single interpreter cannot
+    keep up with the parsing.  The events, results and timings are sent
+    back to this process, each device process over its own pipe.  A hung
+    console only holds its own process, which is terminated after the
+    device timeout; that loses only its own pipe, not the other devices'.
+
+    The device names, the "name" or else the console, must be unique in
+    the inventory; the results are keyed by them.
+    """
+    WORKERS = 16        # default size of the worker pool
+    MODES = ['thread', 'gevent', 'process']
+    POLL = 0.5          # seconds between checks on the worker processes
+
+    # -------------------------------------------------------------------------
+    # CONSTRUCTOR
+    # -------------------------------------------------------------------------
+
+    def __init__(self, inventory, **kvargs):
+        """
+        :inventory:
+          list of device dicts, or the path to a JSON inventory file
+
+        kvargs['args']
+          list of command arguments common to every device, e.g.
+          ['-u', 'root', '-P', 'pass123']
+
+        kvargs['workers']
+          the maximum number of consoles driven at the same time
+
+        kvargs['notify']
+          event notify callback, called as notify(name, event, message)
+
+        kvargs['mode']
+          'thread' (default), 'gevent' or 'process'
+
+        kvargs['timeout']
+          in 'process' mode, seconds before a device process is
+          terminated and the device failed; defaults to no limit
+
+        kvargs['limit']
+          the number of sessions allowed at the same time per console
+          server or serial hub, defaults to no limit
+
+        kvargs['limits']
+          dict of per console server (or hub) limits, overriding :limit:
+
+        kvargs['retries']
+          the number of times a device is retried when its console port
+          is in use or not ready, defaults to Scheduler.RETRIES
+
+        kvargs['metrics']
+          Metrics shared by every device, to aggregate the fleet timings
+
+        kvargs['events']
+          EventStream shared by every device; the events are written to
+          it instead of being notified
+
+        kvargs['record']
+          transcript file name; each device records its session to its
+          own file, with the device name added before the extension
+        """
+        if isinstance(inventory, basestring):
+            with open(inventory, 'r') as f:
+                inventory = json.load(f)
+
+        names = set()
+        for dev in inventory:
+            name = self._device_name(dev)
+            if name in names:
+                raise ValueError(
+                    "duplicate device name in inventory: {0}".format(name))
+            names.add(name)
+
+        self.inventory = inventory
+        self.args = list(kvargs.get('args') or [])
+        self.workers = int(kvargs.get('workers') or self.WORKERS)
+        self.on_notify = kvargs.get('notify', None)
+        self.mode = kvargs.get('mode') or 'thread'
+        self.metrics = kvargs.get('metrics', None)
+        self.events = kvargs.get('events', None)
+        self.timeout = kvargs.get('timeout', None)
+        self.limit = kvargs.get('limit', None)
+        self.limits = kvargs.get('limits', None)
+        self.retries = kvargs.get('retries', Scheduler.RETRIES)
+        self.record = kvargs.get('record', None)
+        if self.mode not in self.MODES:
+            raise ValueError("unknown fleet mode: {0}".format(self.mode))
+
+        self._lock = threading.Lock()
+
+        #
+        # public attributes
+        #
+        self.results = {}
+
+    # -------------------------------------------------------------------------
+    # run the fleet, returns a dict of per-device results keyed by name
+    # -------------------------------------------------------------------------
+
+    def run(self):
+        if self.mode == 'gevent':
+            return self._run_gevent()
+        if self.mode == 'process':
+            return self._run_processes()
+        return self._run_threads()
+
+    def _scheduler(self):
+        jobs = [dict(dev=dev, name=self._device_name(dev),
+                     server=self._device_server(dev))
+                for dev in self.inventory]
+        return Scheduler(jobs, limit=self.limit, limits=self.limits,
+                         retries=self.retries)
+
+    def _worker(self, sched):
+        while True:
+            job = sched.get()
+            if job is None:
+                return
+            self._run_job(sched, job)
+
+    def _run_threads(self):
+        sched = self._scheduler()
+        nworkers = min(self.workers, len(self.inventory))
+        threads = [threading.Thread(target=self._worker, args=(sched,))
+                   for n in range(nworkers)]
+        for t in threads:
+            t.daemon = True
+            t.start()
+        for t in threads:
+            t.join()
+
+        return self.results
+
+    def _run_gevent(self):
+        try:
+            from gevent import monkey
+            from gevent.pool import Pool
+        except ImportError:
+            raise RuntimeError("fleet mode 'gevent' requires the gevent package")
+
+        if not monkey.is_module_patched('socket'):
+            raise RuntimeError(
+                "fleet mode 'gevent' requires gevent.monkey.patch_all() "
+                "before the console transports are imported")
+
+        sched = self._scheduler()
+        pool = Pool(self.workers)
+        for n in range(min(self.workers, len(self.inventory))):
+            pool.spawn(self._worker, sched)
+        pool.join()
+
+        return self.results
+
+    def _run_processes(self):
+        import multiprocessing
+
+        sched = self._scheduler()
+        running = {}
+
+        def _failed(job, errmsg):
+            if self.events is not None:
+                self.events.emit('result', device=job['name'],
+                                 result='failed', changed=False, errmsg=errmsg)
+            else:
+                self._notify(job['name'], 'ERROR', errmsg)
+            self._job_done(sched, job, dict(changed=False, failed=True,
+                                            errmsg=errmsg))
+
+        def _receive(conn):
+            """ handle the messages waiting on :conn:, return the results """
+            results = None
+            try:
+                while conn.poll():
+                    got = self._process_message(conn.recv())
+                    if got is not None:
+                        results = got[1]
+            except (EOFError, IOError):
+                pass        # the device process is gone
+            return results
+
+        while not sched.finished:
+            while len(running) < self.workers:
+                job = sched.get(block=False)
+                if job is None:
+                    break
+                conn, child = multiprocessing.Pipe(duplex=False)
+                proc = multiprocessing.Process(target=self._process_device,
+                                               args=(job['dev'], child))
+                proc.daemon = True
+                proc.start()
+                child.close()
+                deadline = time() + self.timeout if self.timeout else None
+                running[job['name']] = (job, proc, conn, deadline)
+
+            select([run[2] for run in running.values()], [], [], self.POLL)
+
+            for name, (job, proc, conn, deadline) in running.items():
+                # whatever an exited process sent is already in its pipe
+                alive = proc.is_alive()
+                results = _receive(conn)
+                if results is None:
+                    if deadline is not None and time() >= deadline:
+                        proc.terminate()
+                        errmsg = 'timeout after {0}s'.format(self.timeout)
+                    elif alive is False:
+                        proc.join()
+                        errmsg = 'exited with code {0}'.format(proc.exitcode)
+                    else:
+                        continue
+                proc.join()
+                conn.close()
+                del running[name]
+                if results is not None:
+                    self._job_done(sched, job, results)
+                else:
+                    _failed(job, errmsg)
+
+        return self.results
+
+    def _process_device(self, dev, conn):
+        """ the device process, reports back through the pipe :conn: """
+        name = self._device_name(dev)
+
+        def _notify(obj, event, message):
+            conn.send(('notify', name, event, message))
+
+        # a fresh Metrics, the parent merges the snapshot
+        metrics = Metrics() if self.metrics is not None else None
+        events = _PipeEvents(conn) if self.events is not None else None
+
+        results = self._run_session(dev, _notify, metrics, events)
+        if results.get('facts') is not None:
+            # the lazy facts are bound to the session, send the values
+            results['facts'] = dict(results['facts'])
+        conn.send(('result', name, results,
+                   metrics.snapshot() if metrics is not None else None))
+        conn.close()
+
+    def _process_message(self, msg):
+        """
+        handle a message from a device process, returns the tuple
+        (<name>, <results>) for a result
+        """
+        kind = msg[0]
+        if kind == 'notify':
+            self._notify(*msg[1:])
+        elif kind == 'emit':
+            self.events.emit(msg[1], **msg[2])
+        elif kind == 'result':
+            name, results, snapshot = msg[1:]
+            if snapshot is not None:
+                self.metrics.merge(snapshot)
+            return (name, results)
+
+    # -------------------------------------------------------------------------
+    # per-device processing
+    # -------------------------------------------------------------------------
+
+    def _device_name(self, dev):
+        if dev.get('name'):
+            return dev['name']
+        for opt in ['ssh', 'telnet', 'port']:
+            if opt in dev:
+                return str(dev[opt])
+        return 'serial'
+
+    def _device_args(self, dev):
+        """ build the netconify command arguments for the device """
+        argv = list(self.args)
+        for opt in _CONSOLE_OPTS:
+            if opt in dev:
+                argv += ['--' + opt, str(dev[opt])]
+        argv += [str(arg) for arg in dev.get('args', [])]
+        if self.record is not None:
+            base, ext = os.path.splitext(self.record)
+            name = re.sub(r'[^\w.-]+', '_', self._device_name(dev))
+            argv += ['--record', '{0}-{1}{2}'.format(base, name, ext)]
+        if dev.get('name'):
+            argv.append(dev['name'])
+        return argv
+
+    def _device_server(self, dev):
+        """ the console server (or serial hub) the device is reached on """
+        if dev.get('hub'):
+            return str(dev['hub'])
+        for opt in ['telnet', 'ssh']:
+            if opt in dev:
+                return re.split('[,:]', str(dev[opt]))[0]
+        return None
+
+    def _run_job(self, sched, job):
+        name = job['name']
+
+        def _notify(obj, event, message):
+            self._notify(name, event, message)
+
+        results = self._run_session(job['dev'], _notify, self.metrics,
+                                    self.events)
+        self._job_done(sched, job, results)
+
+    def _job_done(self, sched, job, results):
+        """ keep the results, unless the scheduler retries the job """
+        backoff = sched.done(job, results)
+        if backoff is None:
+            with self._lock:
+                self.results[job['name']] = results
+            return
+
+        if self.events is not None:
+            self.events.emit('retry', device=job['name'],
+                             attempt=job['attempt'], backoff=backoff,
+                             errmsg=results['errmsg'])
+        else:
+            self._notify(job['name'], 'retry', '{0}, retry {1} in {2:.1f}s'.format(
+                results['errmsg'], job['attempt'], backoff))
+
+    def _run_session(self, dev, notify, metrics, events):
+        """ run netconify for the device, return the results """
+        if events is not None:
+            notify = None       # the device writes its own events
+        # a single open attempt, the scheduler owns the retry backoff
+        nc = netconifyCmdo(notify=notify, metrics=metrics, events=events,
+                           retry_open=1)
+        try:
+            results = nc.run(self._device_args(dev))
+        except (Exception, SystemExit) as err:
+            results = nc.results
+            results['failed'] = True
+            results['errmsg'] = results['errmsg'] or str(err)
+            # make sure we do not leave the console connection open
+            try:
+                nc._tty._tty_close()
+            except:
+                pass
+        return results
+
+    def _notify(self, name, event, message):
+        with self._lock:
+            if self.on_notify is not None:
+                self.on_notify(name, event, message)
+            else:
+                print "{0}:{1}:{2}".format(name, event, message)
+
+
+class _PipeEvents(object):
+
+    """ EventStream stand-in for a device process, sends to the parent """
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def emit(self, event, **fields):
+        fields.setdefault('time', time())
+        self._conn.send(('emit', event, fields))
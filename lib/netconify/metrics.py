@@ -0,0 +1,162 @@
+"""
+This file defines the 'Metrics' class.
+Used to collect the per-phase timings of the console sessions.
+"""
+import os
+import json
+import threading
+from time import time
+
+__all__ = ['Metrics', 'Timing']
+
+
+class Timing(dict):
+
+    """
+    a 'timing' notify event message: the metric name, the elapsed seconds
+    and the labels, as a dict.  it prints as one readable line for the
+    'netconify' shell utility output.
+    """
+
+    def __init__(self, metric, seconds, **labels):
+        dict.__init__(self, labels, metric=metric, seconds=seconds)
+
+    def __str__(self):
+        labels = ' '.join('{0}={1}'.format(k, v) for k, v in sorted(self.items())
+                          if k not in ('metric', 'seconds'))
+        return '{0} {1:.3f}s {2}'.format(self['metric'], self['seconds'],
+                                         labels).rstrip()
+
+
+class Metrics(object):
+
+    """
+    Thread-safe collection of histograms (timings) and counters (bytes),
+    each keyed by name and labels.  One Metrics may be shared by several
+    Terminals, e.g. in fleet mode, to aggregate a whole run.  A snapshot
+    is saved as JSON, or in the Prometheus text format when the file name
+    ends with '.prom'.
+    """
+    PREFIX = 'netconify_'
+    BUCKETS = [0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900]
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+        self.started = time()
+
+    @staticmethod
+    def _key(name, labels):
+        return (name, tuple(sorted(labels.items())))
+
+    # -------------------------------------------------------------------------
+    # recording
+    # -------------------------------------------------------------------------
+
+    def observe(self, name, value, **labels):
+        """ add :value: to the histogram :name: """
+        with self._lock:
+            h = self._histograms.get(self._key(name, labels))
+            if h is None:
+                h = dict(count=0, sum=0.0, min=value, max=value,
+                         buckets=[0] * len(self.BUCKETS))
+                self._histograms[self._key(name, labels)] = h
+            h['count'] += 1
+            h['sum'] += value
+            h['min'] = min(h['min'], value)
+            h['max'] = max(h['max'], value)
+            for n, le in enumerate(self.BUCKETS):
+                if value <= le:
+                    h['buckets'][n] += 1
+
+    def inc(self, name, value=1, **labels):
+        """ add :value: to the counter :name: """
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def merge(self, snapshot):
+        """ add a snapshot() taken from another Metrics, e.g. a process """
+        with self._lock:
+            for h in snapshot['histograms']:
+                key = self._key(h['name'], h['labels'])
+                mine = self._histograms.get(key)
+                if mine is None:
+                    mine = dict(count=0, sum=0.0, min=h['min'], max=h['max'],
+                                buckets=[0] * len(self.BUCKETS))
+                    self._histograms[key] = mine
+                mine['count'] += h['count']
+                mine['sum'] += h['sum']
+                mine['min'] = min(mine['min'], h['min'])
+                mine['max'] = max(mine['max'], h['max'])
+                for n, le in enumerate(self.BUCKETS):
+                    mine['buckets'][n] += h['buckets'][str(le)]
+            for c in snapshot['counters']:
+                key = self._key(c['name'], c['labels'])
+                self._counters[key] = self._counters.get(key, 0) + c['value']
+
+    # -------------------------------------------------------------------------
+    # snapshot
+    # -------------------------------------------------------------------------
+
+    def snapshot(self):
+        """ return the metrics as a dict, suitable for JSON """
+        with self._lock:
+            histograms = [dict(name=name, labels=dict(labels),
+                               count=h['count'], sum=h['sum'],
+                               min=h['min'], max=h['max'],
+                               buckets=dict(zip([str(le) for le in self.BUCKETS],
+                                                h['buckets'])))
+                          for (name, labels), h in sorted(self._histograms.items())]
+            counters = [dict(name=name, labels=dict(labels), value=value)
+                        for (name, labels), value in sorted(self._counters.items())]
+        return dict(started=self.started, time=time(),
+                    histograms=histograms, counters=counters)
+
+    def prometheus(self):
+        """ return the metrics in the Prometheus text exposition format """
+        def _labels(labels, **extra):
+            labels = sorted(labels.items()) + sorted(extra.items())
+            if not labels:
+                return ''
+            return '{' + ','.join('{0}="{1}"'.format(
+                k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                for k, v in labels) + '}'
+
+        snap = self.snapshot()
+        lines = []
+        typed = set()
+        for h in snap['histograms']:
+            name = self.PREFIX + h['name']
+            if name not in typed:
+                typed.add(name)
+                lines.append('# TYPE {0} histogram'.format(name))
+            for le in self.BUCKETS:
+                lines.append('{0}_bucket{1} {2}'.format(
+                    name, _labels(h['labels'], le=le), h['buckets'][str(le)]))
+            lines.append('{0}_bucket{1} {2}'.format(
+                name, _labels(h['labels'], le='+Inf'), h['count']))
+            lines.append('{0}_sum{1} {2}'.format(
+                name, _labels(h['labels']), h['sum']))
+            lines.append('{0}_count{1} {2}'.format(
+                name, _labels(h['labels']), h['count']))
+        for c in snap['counters']:
+            name = self.PREFIX + c['name']
+            if name not in typed:
+                typed.add(name)
+                lines.append('# TYPE {0} counter'.format(name))
+            lines.append('{0}{1} {2}'.format(
+                name, _labels(c['labels']), c['value']))
+        return '\n'.join(lines) + '\n'
+
+    def save(self, path):
+        """ write the snapshot to :path:, replacing the file atomically """
+        if path.endswith('.prom'):
+            content = self.prometheus()
+        else:
+            content = json.dumps(self.snapshot(), indent=2)
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(content)
+        os.rename(tmp, path)
@@ -0,0 +1,124 @@
+"""
+This file defines the 'Scheduler' class.
+Used by the fleet to hand the device jobs to the workers.
+"""
+import random
+import threading
+from time import time
+
+__all__ = ['Scheduler']
+
+
+class Scheduler(object):
+
+    """
+    Queue of device jobs, handed out so that no more than the limit of
+    sessions run at the same time on any one console server (or serial
+    hub).  A job that failed because the console port was in use or not
+    ready is queued again after a jittered exponential backoff; while it
+    waits, its slot goes to the next job.
+
+    Each job is a dict with at least 'server', the console server the
+    job runs on (None for no limit), and gets an 'attempt' count.
+    """
+    RETRIES = 5             # retries of a busy port, per job
+    BACKOFF = 2             # seconds, doubled with each retry
+    BACKOFF_MAX = 60        # seconds, longest backoff
+    RETRY_ON = ['in use', 'not ready']  # errmsg text that is retried
+
+    def __init__(self, jobs, **kvargs):
+        """
+        :jobs:
+          list of job dicts, run in this order
+
+        kvargs['limit']
+          the number of sessions allowed per console server, defaults
+          to no limit
+
+        kvargs['limits']
+          dict of per console server limits, overriding :limit:
+
+        kvargs['retries']
+          the number of retries of a busy port, defaults to :RETRIES:
+        """
+        self.limit = kvargs.get('limit')
+        self.limits = kvargs.get('limits') or {}
+        self.retries = kvargs.get('retries', self.RETRIES)
+
+        self._cond = threading.Condition()
+        self._pending = []
+        self._active = {}
+        self._unfinished = len(jobs)
+        for job in jobs:
+            job.setdefault('attempt', 0)
+            self._pending.append((0, job))
+
+    @property
+    def finished(self):
+        """ True once every job has completed, retries included """
+        with self._cond:
+            return self._unfinished == 0
+
+    def _limit(self, server):
+        if server is None:
+            return None
+        return self.limits.get(server, self.limit)
+
+    def _ready(self, now):
+        """ the first job that may start now, and the seconds until one may """
+        wait = None
+        for n, (not_before, job) in enumerate(self._pending):
+            limit = self._limit(job['server'])
+            if limit is not None and self._active.get(job['server'], 0) >= limit:
+                continue        # a slot is freed by done()
+            if not_before <= now:
+                return n, None
+            if wait is None or not_before - now < wait:
+                wait = not_before - now
+        return None, wait
+
+    # -------------------------------------------------------------------------
+    # workers
+    # -------------------------------------------------------------------------
+
+    def get(self, block=True):
+        """
+        return the next job that may start, waiting for one when :block:.
+        returns None when every job has completed, or when not blocking
+        and no job may start now.
+        """
+        with self._cond:
+            while self._unfinished > 0:
+                n, wait = self._ready(time())
+                if n is not None:
+                    not_before, job = self._pending.pop(n)
+                    self._active[job['server']] = \
+                        self._active.get(job['server'], 0) + 1
+                    return job
+                if block is False:
+                    return None
+                self._cond.wait(wait)
+            return None
+
+    def done(self, job, results):
+        """
+        the :job: has completed with :results:; its slot is released.
+        returns the backoff seconds when the job was queued again to
+        be retried, or None when it is finished.
+        """
+        with self._cond:
+            self._active[job['server']] -= 1
+            errmsg = results.get('errmsg') or ''
+            retry = results.get('failed') and job['attempt'] < self.retries \
+                and any(text in errmsg for text in self.RETRY_ON)
+            backoff = None
+            if retry:
+                # full jitter, so the retries of many jobs spread out
+                backoff = random.uniform(0, min(
+                    self.BACKOFF_MAX, self.BACKOFF * 2 ** job['attempt']))
+                job['attempt'] += 1
+                self._pending.append((time() + backoff, job))
+            else:
+                self._unfinished -= 1
+            self._cond.notify_all()
+            return backoff
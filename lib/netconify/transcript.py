@@ -0,0 +1,77 @@
+"""
+This file defines the 'Transcript' class.
+Used to record the byte stream of a console session, for replay.
+"""
+import json
+import threading
+from time import time
+
+__all__ = ['Transcript']
+
+
+class Transcript(object):
+
+    """
+    Records a console session as JSON lines: a header, then one entry per
+    wire transfer with the seconds since the recording started, the
+    direction and the bytes:
+
+        {"t": 0.4187, "dir": "rx", "data": "login: "}
+
+    'tx' is written to the console, 'rx' is received from it, and 'prompt'
+    notes the prompt read_prompt() matched (or 'timeout'), for the reader.
+    The bytes are kept as latin-1 text, so any byte value round-trips.
+    Each entry is flushed as it is written, so a transcript of a session
+    that hung or crashed is complete up to that point.
+    """
+    VERSION = 1
+
+    def __init__(self, path, **kvargs):
+        """
+        :path:
+          the transcript file, overwritten
+
+        kvargs['tty']
+          the console name, for the header
+        """
+        self.path = path
+        self.started = time()
+        self._lock = threading.Lock()
+        self._out = open(path, 'w')
+        self._write(dict(version=self.VERSION, started=self.started,
+                         tty=kvargs.get('tty')))
+
+    def _write(self, entry):
+        with self._lock:
+            if self._out is None:
+                return
+            self._out.write(json.dumps(entry) + '\n')
+            self._out.flush()
+
+    def record(self, direction, data):
+        """ record :data: sent ('tx') or received ('rx') now """
+        self._write(dict(t=round(time() - self.started, 6), dir=direction,
+                         data=data.decode('latin-1')))
+
+    def close(self):
+        with self._lock:
+            if self._out is not None:
+                self._out.close()
+                self._out = None
+
+    @staticmethod
+    def load(path):
+        """
+        read the transcript at :path:, return a list of
+        tuple(<seconds>, <direction>, <bytes>)
+        """
+        entries = []
+        with open(path, 'r') as f:
+            header = json.loads(f.readline())
+            if header.get('version') != Transcript.VERSION:
+                raise ValueError("{0}: not a netconify transcript".format(path))
+            for line in f:
+                entry = json.loads(line)
+                entries.append((entry['t'], entry['dir'],
+                                entry['data'].encode('latin-1')))
+        return entries
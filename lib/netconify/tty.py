@@ -1,11 +1,67 @@
-from time import sleep
-from datetime import datetime, timedelta
+import re
+from time import time, sleep
 from . import cmdo
 
 from .tty_netconf import tty_netconf
+from .metrics import Metrics, Timing
 
 __all__ = ['Terminal']
 
+# =========================================================================
+# prompt matching, shared by all of the TTY transports
+# =========================================================================
+
+
+class _PromptMatcher(object):
+
+    """
+    Incremental prompt matcher.  Received text is fed in chunks, and only
+    the new chunk plus a small lookbehind window of the text before it is
+    searched, so the work is linear in the text received and a prompt
+    split across two chunks is still found.
+    """
+    LOOKBEHIND = 64         # bytes of prior text searched with each chunk
+
+    def __init__(self, expect):
+        self._expect = expect
+        self.reset()
+
+    def reset(self, text=''):
+        """ start over with :text:, return the matched state or None """
+        self._chunks = []
+        self._size = 0
+        self._tail = ''
+        self.found = None
+        self.offset = None
+        self._end = None
+        return self.feed(text)
+
+    @property
+    def text(self):
+        return ''.join(self._chunks)
+
+    def feed(self, data):
+        """ add received :data:, return the matched state or None """
+        if not data:
+            return self.found
+        self._chunks.append(data)
+        window = self._tail + data
+        base = self._size - len(self._tail)
+        self._size += len(data)
+        self._tail = window[-self.LOOKBEHIND:]
+
+        got = self._expect.search(window)
+        if got is not None:
+            self.found = got.lastgroup
+            self.offset = base + got.start()
+            self._end = base + got.end()
+        return self.found
+
+    def split(self):
+        """ return tuple(<text thru the match>, <text after the match>) """
+        text = self.text
+        return (text[:self._end], text[self._end:])
+
 # =========================================================================
 # Terminal class
 # =========================================================================
@@ -30,6 +86,11 @@ class Terminal(object):
     TIMEOUT = 0.2           # serial readline timeout, seconds
     EXPECT_TIMEOUT = 10     # total read timeout, seconds
     LOGIN_RETRY = 20         # total number of passes thru login state-machine
+    LOGIN_TIMEOUT = 900     # login deadline incl. booting from loader, seconds
+    LOGOUT_RETRY = 10       # total number of passes thru logout state-machine
+    LOGOUT_TIMEOUT = 60     # logout deadline, seconds
+    WRITE_CHUNK = 256       # bytes per write for large transfers
+    WRITE_PROGRESS = 10     # progress is notified every N percent
 
     _ST_INIT = 0
     _ST_LOADER = 1
@@ -38,6 +99,8 @@ class Terminal(object):
     _ST_DONE = 4
     _ST_BAD_PASSWD = 5
     _ST_TTY_NOLOGIN = 6
+    _ST_CLI_WAIT = 7
+    _ST_REBOOT = 8
 
     _re_pat_login = '(?P<login>ogin:\s*$)'
 
@@ -50,6 +113,8 @@ class Terminal(object):
         '(?P<cli>[^\\-"]>\s*$)'
     ]
 
+    _PROMPT = re.compile('|'.join(_RE_PAT))
+
     # -----------------------------------------------------------------------
     # CONSTRUCTOR
     # -----------------------------------------------------------------------
@@ -66,6 +131,24 @@ class Terminal(object):
         :kvargs['attempts']:
           the total number of login attempts thru the login
           state-machine
+
+        :kvargs['write_rate']:
+          limits large transfers to this many bytes per second,
+          defaults to no limit
+
+        :kvargs['metrics']:
+          Metrics that collect the session timings, may be shared by
+          several Terminals; a new one is used by default
+
+        :kvargs['timing']:
+          when True, the timings are also notified as 'timing' events
+
+        :kvargs['tracer']:
+          callable(tty, direction, data) that takes the wire trace of
+          --verbose 2, instead of printing it
+
+        :kvargs['transcript']:
+          Transcript that records the bytes sent and received
         """
         # logic args
         self.user = kvargs.get('user', 'root')
@@ -73,6 +156,11 @@ class Terminal(object):
         self.c_user = kvargs.get('s_user', self.user)
         self.c_passwd = kvargs.get('s_passwd', self.passwd)
         self.login_attempts = kvargs.get('attempts') or self.LOGIN_RETRY
+        self.write_rate = kvargs.get('write_rate')
+        self.metrics = kvargs.get('metrics') or Metrics()
+        self.timing_events = kvargs.get('timing', False)
+        self.tracer = kvargs.get('tracer')
+        self.transcript = kvargs.get('transcript')
 
         # misc setup
         self.nc = tty_netconf(self)
@@ -80,6 +168,8 @@ class Terminal(object):
         self.notifier = None
         self._badpasswd = 0
         self._loader = 0
+        self._rxbuf = ''
+        self._matcher = _PromptMatcher(self._PROMPT)
 
     @property
     def tty_name(self):
@@ -90,6 +180,124 @@ class Terminal(object):
             return
         self.notifier(self, event, message)
 
+    def trace(self, direction, data):
+        """ wire trace of the :data: received ('rx') or sent ('tx') """
+        if self.tracer is not None:
+            self.tracer(self, direction, data)
+        else:
+            print(data)
+
+    # -----------------------------------------------------------------------
+    # session transcript, transports pass the wire data through these
+    # -----------------------------------------------------------------------
+
+    def _wire_tx(self, data):
+        """ :data: is about to be written to the console """
+        if self.transcript is not None:
+            self.transcript.record('tx', data)
+        return data
+
+    def _wire_rx(self, data):
+        """ :data: was received from the console """
+        if data and self.transcript is not None:
+            self.transcript.record('rx', data)
+        return data
+
+    # -----------------------------------------------------------------------
+    # timing instrumentation
+    # -----------------------------------------------------------------------
+
+    @property
+    def console(self):
+        """ the console endpoint, without any credentials """
+        return ':'.join(self.tty_name.split(':')[:2])
+
+    def _timing(self, metric, started, notify=True, **labels):
+        """
+        record the seconds since :started: in the :metric: histogram, and
+        notify them as a 'timing' event.  returns the elapsed seconds.
+        """
+        elapsed = time() - started
+        labels['console'] = self.console
+        self.metrics.observe(metric, elapsed, **labels)
+        if notify is True and self.timing_events is True:
+            self.notify('timing', Timing(metric, elapsed, **labels))
+        return elapsed
+
+    # -----------------------------------------------------------------------
+    # paced writing of large content, e.g. configuration files
+    # -----------------------------------------------------------------------
+
+    def _write_chunk(self, chunk):
+        """
+        write one chunk of a large transfer.  transports with flow control
+        override this so the write waits for the line to drain.
+        """
+        self.rawwrite(chunk)
+
+    def rawwrite_paced(self, content, event='write'):
+        """
+        write :content: as-is in WRITE_CHUNK pieces, so the device's tty
+        input buffer is not overrun.  the transfer is held to :write_rate:
+        bytes per second when set, and the progress is reported through
+        notify using :event:
+        """
+        total = len(content)
+        start = time()
+        report = self.WRITE_PROGRESS
+
+        for sent in range(0, total, self.WRITE_CHUNK):
+            chunk = content[sent:sent + self.WRITE_CHUNK]
+            self._write_chunk(chunk)
+            sent += len(chunk)
+
+            if self.write_rate:
+                # wait until the line has caught up with what was sent
+                ahead = start + float(sent) / self.write_rate - time()
+                if ahead > 0:
+                    sleep(ahead)
+
+            if sent * 100 >= total * report:
+                elapsed = time() - start
+                self.notify(event, 'sent {0}% ({1}/{2} bytes, {3} B/s)'.format(
+                    sent * 100 // total, sent, total,
+                    int(sent / elapsed) if elapsed else sent))
+                while sent * 100 >= total * report:
+                    report += self.WRITE_PROGRESS
+
+    # -----------------------------------------------------------------------
+    # prompt reading, transports provide _read_ready()
+    # -----------------------------------------------------------------------
+
+    def read_prompt(self, timeout=None):
+        """
+        reads text from the TTY as it arrives until a prompt is matched,
+        for up to :timeout: seconds, EXPECT_TIMEOUT by default.
+        When a match is found, return a tuple(<text>,<found>) where
+        <text> is the text up to and including the prompt and <found> is
+        the name of the regular-expression group; the offset of the prompt
+        in the text is in self._matcher.offset.  If a timeout occurs, then
+        return the tuple(None,None).  Any text received after the prompt,
+        or without one before the timeout, is kept for the next read.
+        """
+        matcher = self._matcher
+        found = matcher.reset(self._rxbuf)
+        self._rxbuf = ''
+        mark_end = time() + (timeout or self.EXPECT_TIMEOUT)
+
+        while found is None:
+            if time() >= mark_end:
+                self._rxbuf = matcher.text
+                if self.transcript is not None:
+                    self.transcript.record('prompt', 'timeout')
+                return (None, None)
+            found = matcher.feed(self._read_ready())
+
+        text, self._rxbuf = matcher.split()
+        if self.transcript is not None:
+            self.transcript.record('prompt', found)
+        return (text, found)
+
     # -----------------------------------------------------------------------
     # Login/logout
     # -----------------------------------------------------------------------
@@ -100,37 +308,80 @@ class Terminal(object):
         start the NETCONF XML API process
         """
         self.notifier = notify
+        started = time()
         self.notify('TTY', 'connecting to TTY:{0} ...'.format(self.tty_name))
         self._tty_open()
+        self._timing('phase_seconds', started, phase='open')
 
         self.notify('TTY', 'logging in ...')
-
         self.state = self._ST_INIT
+        self._login('login_sm')
+        self._timing('phase_seconds', started, phase='login')
+        return True
+
+    def relogin(self):
+        """
+        login again on the open TTY once the device is rebooting, e.g.
+        after a zeroize, and start a new NETCONF XML API process.  the
+        boot messages are passed over until the device is back at the
+        loader or login prompt, for up to LOGIN_TIMEOUT.
+        """
+        started = time()
+        self.notify('TTY', 'waiting for the device to reboot ...')
+
+        # the NETCONF session, and the facts, went away with the reboot
+        self.nc = tty_netconf(self)
+        self._tty_pre_relogin()
+        self._loader = 0
+        self._badpasswd = 0
+        self.state = self._ST_REBOOT
+        self._login('reboot_wait')
+        self._timing('phase_seconds', started, phase='relogin')
+        return True
+
+    def _login(self, phase):
+        """ run the login state-machine, timed as :phase:, start NETCONF """
+        mark = time()
         self._login_state_machine()
+        self._tty_post_login()
+        self._timing('phase_seconds', mark, phase=phase)
 
         # now start NETCONF XML
         self.notify('TTY', ' OK ... starting NETCONF')
+        mark = time()
         self.nc.open(at_shell=self.at_shell)
-        return True
+        self._timing('phase_seconds', mark, phase='netconf_open')
 
     def logout(self):
         """
         cleanly logout of the TTY
         """
         self.notify('logout', 'logging out ...')
+        started = time()
         self.nc.close()
+        self._tty_pre_logout()
         self._logout_state_machine()
+        self._timing('phase_seconds', started, phase='logout')
         return True
 
-        # ---------------------------------------------------------------------
-        # TTY logout state-machine
-        # ---------------------------------------------------------------------
+    def _tty_post_login(self):
+        """ transport hook, called once logged in before NETCONF starts """
+        pass
+
+    def _tty_pre_logout(self):
+        """ transport hook, called once NETCONF is closed before logout """
+        pass
 
-    def _logout_state_machine(self, attempt=0):
-        if 10 == attempt:
-            raise RuntimeError('logout_sm_failure')
+    def _tty_pre_relogin(self):
+        """ transport hook, called as the device reboots, before relogin """
+        pass
+
+    # -----------------------------------------------------------------------
+    # TTY logout state-machine
+    # -----------------------------------------------------------------------
 
-        prompt, found = self.read_prompt()
+    def _logout_state_machine(self):
+        deadline = time() + self.LOGOUT_TIMEOUT
 
         def _ev_login():
             # back at login prompt, so we are cleanly done!
@@ -142,44 +393,44 @@ class Terminal(object):
         def _ev_cli():
             self.write('exit')
 
+        def _ev_none():
+            # no prompt yet, wait for the next one
+            pass
+
         _ev_tbl = {
             'login': _ev_login,
             'shell': _ev_shell,
             'cli': _ev_cli
         }
 
-        _ev_tbl[found]()
+        for attempt in range(self.LOGOUT_RETRY):
+            if time() >= deadline:
+                break
 
-        if found == 'login':
-            return True
-        else:
-            sleep(1)
-            self._logout_state_machine(attempt=attempt + 1)
+            # read_prompt returns as soon as the next prompt is received
+            prompt, found = self.read_prompt()
+            _ev_tbl.get(found, _ev_none)()
+
+            if found == 'login':
+                return True
+
+        raise RuntimeError('logout_sm_failure')
 
     # -----------------------------------------------------------------------
     # TTY login state-machine
     # -----------------------------------------------------------------------
-    def _login_state_machine(self, attempt=0):
-        if self.login_attempts == attempt:
-            raise RuntimeError('login_sm_failure')
 
-        prompt, found = self.read_prompt()
-
-        if cmdo.verbose == 1:
-            self.notify('\nDEBUG:current state', "{0}".format(self.state))
-            self.notify('DEBUG:login', "IN:{0}:`{1}`".format(found, prompt))
-            self.notify('DEBUG:password', "{0}".format(self.passwd))
-            self.notify('DEBUG:attempt', "{0}".format(attempt))
+    def _login_state_machine(self):
+        deadline = time() + self.LOGIN_TIMEOUT
+        attempt = 0
 
         def _ev_loader():
-            self.state = self._ST_LOADER
-            self.write('boot')
-            self.write('\n')
-            sleep(300)
-            self._login_state_machine(attempt=0)
             self._loader += 1
             if self._loader == 2:
                 raise RuntimeError("propably corrupted image, stuck in loader")
+            self.state = self._ST_LOADER
+            self.write('boot')
+            self.write('\n')
 
         def _ev_login():
             self.state = self._ST_LOGIN
@@ -207,8 +458,7 @@ class Terminal(object):
                 self.state = self._ST_TTY_NOLOGIN
                 self.write('<close-session/>')  # @@@ this is a hack
                 # if console connection have a banner or warning
-                # comment-out line above and uncoment lines bellow ... better hack
-                # sleep(5)
+                # comment-out line above and uncoment line bellow ... better hack
                 # self.write('\n')
 
         def _ev_shell():
@@ -225,11 +475,12 @@ class Terminal(object):
         def _ev_cli():
             if self.state == self._ST_INIT:
                 # this means that the shell was left open.  probably not a good thing,
-                # so issue a notify, hit <ENTER> and try again just to be
-                # sure...
+                # so issue a notify, hit <ENTER> and wait for the prompt again just
+                # to be sure...
                 self.notify('login_warn', 'waiting on TTY.')
-                sleep(5)
-                #  return
+                self.state = self._ST_CLI_WAIT
+                self.write('')
+                return
 
             self.at_shell = False
             self.state = self._ST_DONE
@@ -243,10 +494,36 @@ class Terminal(object):
             'cli': _ev_cli
         }
 
-        _ev_tbl.get(found, _ev_tty_nologin)()
+        mark = time()
+        while self.state != self._ST_DONE:
+            if self.login_attempts == attempt:
+                raise RuntimeError('login_sm_failure')
+            if time() >= deadline:
+                raise RuntimeError('login_sm_timeout')
 
-        if self.state == self._ST_DONE:
-            return True
-        else:
-            # if we are here, then loop the event again
-            self._login_state_machine(attempt + 1)
+            # read_prompt returns as soon as the next prompt is received
+            prompt, found = self.read_prompt()
+
+            # the time each prompt took to arrive, by prompt
+            self._timing('login_step_seconds', mark, notify=False,
+                         prompt=found or 'none')
+            mark = time()
+
+            if cmdo.verbose == 1:
+                self.notify('\nDEBUG:current state', "{0}".format(self.state))
+                self.notify('DEBUG:login', "IN:{0}:`{1}`".format(found, prompt))
+                self.notify('DEBUG:password', "{0}".format(self.passwd))
+                self.notify('DEBUG:attempt', "{0}".format(attempt))
+
+            if self.state in (self._ST_REBOOT, self._ST_LOADER) and \
+                    found not in ('loader', 'login'):
+                # still shutting down or booting; the boot messages are
+                # not prompts, so wait for the login until the deadline
+                continue
+
+            _ev_tbl.get(found, _ev_tty_nologin)()
+
+            # booting restarts the login attempts
+            attempt = 0 if found == 'loader' else attempt + 1
+
+        return True
@@ -1,5 +1,9 @@
 import re
 import time
+import gzip
+import base64
+import hashlib
+from StringIO import StringIO
 from . import cmdo
 from lxml import etree
 from lxml.builder import E
@@ -7,14 +11,55 @@ from datetime import datetime, timedelta
 
 
 from .facts import Facts
+from .metrics import Timing
 
 __all__ = ['xmlmode_netconf']
 
 _NETCONF_EOM = ']]>]]>'
-_xmlns = re.compile('xmlns=[^>]+')
-_xmlns_strip = lambda text: _xmlns.sub('', text)
-_junosns = re.compile('junos:')
-_junosns_strip = lambda text: _junosns.sub('', text)
+_ns_strip = lambda name: name[name.find('}') + 1:]
+_rpc_name = re.compile(r'<([\w:-]+)')
+
+
+class _NsStripTarget(object):
+
+    """
+    lxml parser target that builds the reply tree with the namespaces
+    removed from the tags and attributes (xmlns, junos:, xnm:, ...) so
+    the reply can be searched by plain names.  whitespace-only text
+    between the elements is dropped.  when :prune: is given, each
+    element for which prune(element) is True is removed from the tree
+    as soon as it ends, so a large reply is never held whole.
+    """
+
+    def __init__(self, prune=None):
+        self._tb = etree.TreeBuilder()
+        self._data = []
+        self._prune = prune
+
+    def _flush(self):
+        text = ''.join(self._data)
+        self._data = []
+        if text.strip():
+            self._tb.data(text)
+
+    def start(self, tag, attrib):
+        self._flush()
+        attrib = dict((_ns_strip(k), v) for k, v in attrib.items())
+        self._tb.start(_ns_strip(tag), attrib)
+
+    def end(self, tag):
+        self._flush()
+        elem = self._tb.end(_ns_strip(tag))
+        if self._prune is not None and self._prune(elem):
+            parent = elem.getparent()
+            if parent is not None:
+                parent.remove(elem)
+
+    def data(self, data):
+        self._data.append(data)
+
+    def close(self):
+        return self._tb.close()
 
 # =========================================================================
 # xmlmode_netconf
@@ -26,9 +71,14 @@ class tty_netconf(object):
     """
     Basic Junos XML API for bootstraping through the TTY
     """
+    OPEN_TIMEOUT = 60       # seconds to wait for the NETCONF hello
+    SHELL_TMPFILE = '/var/tmp/netconify.conf'   # compressed load, on device
 
     def __init__(self, tty):
         self._tty = tty
+        self._msgid = 0
+        self._rx_bytes = 0
+        self._at_shell = False
         self.hello = None
         self.facts = Facts(self)
 
@@ -39,14 +89,19 @@ class tty_netconf(object):
     def open(self, at_shell):
         """ start the XML API process and receive the 'hello' message """
 
+        self._at_shell = at_shell
         nc_cmd = ('junoscript', 'xml-mode')[at_shell]
         self._tty.write(nc_cmd + ' netconf need-trailer')
 
+        # the TTY read blocks until a line is received, so there is no
+        # need to pause between reads
+        deadline = time.time() + self.OPEN_TIMEOUT
         while True:
-            time.sleep(0.1)
             line = self._tty.read()
             if line.startswith("<!--"):
                 break
+            if time.time() >= deadline:
+                raise RuntimeError('netconf_open_timeout')
 
         self.hello = self._receive()
 
@@ -69,13 +124,81 @@ class tty_netconf(object):
         """
         load-override a Junos 'conf'-style file into the device.  if the
         load is successful, return :True:, otherwise return the XML reply
-        structure for further processing
+        structure for further processing.  the configuration is written
+        in paced chunks, reporting the progress as 'conf' events.
+
+        kvargs['compress']
+          when logged in at the shell, transfer the configuration gzip
+          compressed to a temporary file and load it from there
         """
         action = kvargs.get('action', 'override')
+        if kvargs.get('compress') is True:
+            if self._at_shell is True:
+                return self._load_compressed(content, action)
+            self._tty.notify('conf', 'compressed transfer needs a shell login')
+
         cmd = E('load-configuration', dict(format='text', action=action),
                 E('configuration-text', content)
                 )
+        cmd = etree.tostring(cmd)
+        request = '<rpc>{0}</rpc>'.format(cmd)
+        started = time.time()
+        self._tty.rawwrite_paced(request, event='conf')
+        rsp = self._receive()
+        self._rpc_timing(cmd, started, len(request))
+        rsp = self._rpc_reply(rsp)
+        return rsp if rsp.findtext('.//ok') is None else True
+
+    def get_config(self):
+        """ return the running configuration as Junos 'conf'-style text """
+        rsp = self.rpc('<get-configuration format="text"/>', text=True)
+        if rsp.tag != 'configuration-text':
+            raise RuntimeError("unable to retrieve the configuration")
+        return rsp.text or ''
+
+    def _load_compressed(self, content, action):
+        """
+        leave the XML API for the shell, send the gzip compressed content
+        as base64 to a temporary file, verify its MD5 checksum, then start
+        the XML API again and load the configuration from the file
+        """
+        path = self.SHELL_TMPFILE
+        buf = StringIO()
+        gz = gzip.GzipFile(fileobj=buf, mode='wb')
+        gz.write(content)
+        gz.close()
+        data = buf.getvalue()
+        digest = hashlib.md5(data).hexdigest()
+
+        self.close()
+        self._tty.read_prompt()     # back at the shell
+
+        self._tty.notify('conf', 'sending {0} bytes compressed to {1}'.format(
+            len(data), len(content)))
+        self._tty.write("uudecode -o {0}.gz << 'NETCONIFY_EOF'".format(path))
+        self._tty.rawwrite_paced('begin-base64 644 {0}.gz\n{1}====\n'
+                                 'NETCONIFY_EOF\n'.format(
+                                     path, base64.encodestring(data)),
+                                 event='conf')
+        self._tty.read_prompt()
+
+        self._tty.write('md5 -q {0}.gz'.format(path))
+        text, found = self._tty.read_prompt()
+        if digest not in (text or ''):
+            self._tty.write('rm -f {0}.gz'.format(path))
+            self._tty.read_prompt()
+            self.open(at_shell=True)
+            return etree.XML('<error-in-transfer>checksum mismatch'
+                             '</error-in-transfer>')
+
+        self._tty.write('gunzip -f {0}.gz'.format(path))
+        self._tty.read_prompt()
+        self.open(at_shell=True)
+
+        cmd = E('load-configuration',
+                dict(format='text', action=action, url=path))
         rsp = self.rpc(etree.tostring(cmd))
+        self.rpc(etree.tostring(E('file-delete', E.path(path))))
         return rsp if rsp.findtext('.//ok') is None else True
 
     def commit_check(self):
@@ -164,7 +287,7 @@ class tty_netconf(object):
     # XML RPC command execution
     # -------------------------------------------------------------------------
 
-    def rpc(self, cmd):
+    def rpc(self, cmd, **kvargs):
         """
         Write the XML cmd and return the response as XML object.
 
@@ -174,15 +297,91 @@ class tty_netconf(object):
           'get-software-information', this routine will turn
           it into '<get-software-information/>'
 
+        :kvargs:
+          passed to _receive(), e.g. 'sink', 'prune' and 'text'
+
         NOTES:
           The return XML object is the first child element after
           the <rpc-reply>.  There is also no error-checking
           performing by this routine.
         """
+        cmd = self._rpc_cmd(cmd)
+        request = '<rpc>{0}</rpc>'.format(cmd)
+        started = time.time()
+        self._tty.rawwrite(request)
+        rsp = self._receive(**kvargs)
+        self._rpc_timing(cmd, started, len(request))
+        return self._rpc_reply(rsp)
+
+    def rpcs(self, cmds, **kvargs):
+        """
+        Pipeline several XML cmds; all of the requests are written
+        back-to-back, each with its own message-id, before the replies
+        are read.  The replies are matched to the requests by message-id
+        and returned as a list of XML objects in the same order as :cmds:
+
+        :cmds:
+          list of <str> XML commands, as given to :rpc():
+
+        kvargs['receive']
+          dict of {<index in :cmds:>: <dict of _receive() kvargs>}.  the
+          device replies in order, so these apply to the reply read while
+          that request is the oldest outstanding one
+        """
+        receive = kvargs.get('receive') or {}
+        pending = []
+        requests = {}
+        started = time.time()
+        for n, cmd in enumerate(cmds):
+            self._msgid += 1
+            msgid = str(self._msgid)
+            pending.append(msgid)
+            cmd = self._rpc_cmd(cmd)
+            request = '<rpc message-id="{0}">{1}</rpc>'.format(msgid, cmd)
+            requests[msgid] = (cmd, len(request), receive.get(n, {}))
+            self._tty.rawwrite(request)
+
+        ids = list(pending)
+        replies = {}
+        while pending:
+            rsp = self._receive(**requests[pending[0]][2])
+            msgid = rsp.get('message-id')
+            if msgid not in pending:
+                # a reply that could not be parsed has no message-id,
+                # so it belongs to the oldest outstanding request
+                msgid = pending[0]
+            pending.remove(msgid)
+            # pipelined, so each is timed from the first request written
+            cmd, tx_bytes, _ = requests[msgid]
+            self._rpc_timing(cmd, started, tx_bytes)
+            replies[msgid] = self._rpc_reply(rsp)
+
+        return [replies[msgid] for msgid in ids]
+
+    def _rpc_cmd(self, cmd):
         if not cmd.startswith('<'):
             cmd = '<{0}/>'.format(cmd)
-        self._tty.rawwrite('<rpc>{0}</rpc>'.format(cmd))
-        rsp = self._receive()
+        return cmd
+
+    def _rpc_timing(self, cmd, started, tx_bytes):
+        """
+        record the RPC round-trip time, and the request and reply sizes,
+        labelled by the RPC name
+        """
+        tty = self._tty
+        name = _rpc_name.match(cmd).group(1)
+        elapsed = tty._timing('rpc_seconds', started, notify=False, rpc=name)
+        tty.metrics.inc('rpc_sent_bytes_total', tx_bytes, rpc=name,
+                        console=tty.console)
+        tty.metrics.inc('rpc_received_bytes_total', self._rx_bytes, rpc=name,
+                        console=tty.console)
+        if tty.timing_events is True:
+            tty.notify('timing', Timing('rpc_seconds', elapsed, rpc=name,
+                                        console=tty.console,
+                                        bytes_out=tx_bytes,
+                                        bytes_in=self._rx_bytes))
+
+    def _rpc_reply(self, rsp):
         try:
             return rsp[0]  # return first child after the <rpc-reply>
         except:
@@ -192,31 +391,77 @@ class tty_netconf(object):
     # LOW-LEVEL I/O for reading back XML response
     # -------------------------------------------------------------------------
 
-    def _receive(self):
-        """ process the XML response into an XML object """
-        rxbuf = []
+    def parse(self, text, **kvargs):
+        """
+        parse the XML :text:, e.g. a reply saved by a 'sink', into an XML
+        object the same way a received reply is; return the root element
+
+        kvargs['prune']
+          as for _receive()
+        """
+        target = _NsStripTarget(kvargs.get('prune'))
+        return etree.XML(text, etree.XMLParser(target=target, huge_tree=True))
+
+    def _receive(self, **kvargs):
+        """
+        process the XML response into an XML object.  each line is fed
+        into the parser as it is received, so the reply is never held
+        as text.
+
+        kvargs['sink']
+          file-like object the reply is written to as it is received,
+          byte for byte up to the end-of-message marker
+
+        kvargs['prune']
+          callable(element), elements it returns True for are dropped
+          from the XML object as soon as they are parsed
+
+        kvargs['text']
+          when True, the line breaks are kept, for replies that hold
+          text such as the 'conf'-style configuration
+        """
+        sink = kvargs.get('sink')
+        eol = '\n' if kvargs.get('text') is True else ''
+        target = _NsStripTarget(kvargs.get('prune'))
+        parser = etree.XMLParser(target=target, huge_tree=True)
+        parse_ok = True
+        xnm_error = False
+        message = None
+        self._rx_bytes = 0
+
         while True:
-            line = self._tty.read().strip()
+            raw = line = self._tty.read()
+            self._rx_bytes += len(raw)
+            line = line.strip()
             if cmdo.verbose == 2:
-                print(line)  # enable to see received xml messages
-            if not line:
-                continue  # if we got nothin, go again
+                self._tty.trace('rx', line)  # see received xml messages
             if _NETCONF_EOM == line:
                 break  # check for end-of-message
-            rxbuf.append(line)
+            if sink is not None:
+                sink.write(raw)
+            if not line:
+                continue  # if we got nothin, go again
+
+            # remember the error message in case the reply is not
+            # well-formed and we need to report it
+            if '</xnm:error>' == line:
+                xnm_error = True
+            elif message is None and '<message>' in line:
+                message = line
 
-        rxbuf[0] = _xmlns_strip(rxbuf[0])  # nuke the xmlns
-        rxbuf[1] = _xmlns_strip(rxbuf[1])  # nuke the xmlns
-        rxbuf = map(_junosns_strip, rxbuf)  # nuke junos: namespace
+            if parse_ok is True:
+                try:
+                    parser.feed(line + eol)
+                except etree.XMLSyntaxError:
+                    parse_ok = False  # keep reading through to the EOM
 
         try:
-            as_xml = etree.XML(''.join(rxbuf))
-            return as_xml
-        except:
-            if '</xnm:error>' in rxbuf:
-                for x in rxbuf:
-                    if '<message>' in x:
-                        return etree.XML(
-                            '<error-in-receive>' + x + '</error-in-receive>')
-            else:
-                return etree.XML('<error-in-receive/>')
+            if parse_ok is True:
+                return parser.close()
+        except etree.XMLSyntaxError:
+            pass
+
+        if xnm_error is True and message is not None:
+            return etree.XML(
+                '<error-in-receive>' + message + '</error-in-receive>')
+        return etree.XML('<error-in-receive/>')
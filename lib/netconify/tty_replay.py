@@ -0,0 +1,115 @@
+from time import time, sleep
+
+from .tty import Terminal
+from .transcript import Transcript
+
+__all__ = ['Replay']
+
+
+class Replay(Terminal):
+
+    """
+    Replays a recorded Transcript in place of a console, so a session from
+    the field (a banner, a slow loader, a failed login) runs through the
+    login state-machine and the NETCONF code again without the device.
+
+    The received data is played back in its recorded order.  Each chunk is
+    only delivered once the writes that preceded it in the recording have
+    been made, after the same delay from the last of those writes, divided
+    by :speed:.  What is written is not checked against the recording.
+    """
+
+    def __init__(self, transcript, **kvargs):
+        """
+        :transcript:
+          the transcript file, or a list of entries from Transcript.load()
+
+        :kvargs['speed']:
+          playback speed factor, 1.0 (default) plays back at the recorded
+          pace, 10 ten times faster; 0 delivers the data as soon as it is
+          due by order only
+        """
+        if isinstance(transcript, basestring):
+            self._tty_name = 'replay:{0}'.format(transcript)
+            transcript = Transcript.load(transcript)
+        else:
+            self._tty_name = 'replay'
+        self.speed = float(kvargs.get('speed', 1.0))
+
+        # each rx chunk with the count and time of the writes before it;
+        # the writes before anything was received were made by the
+        # recorded transport when it opened, e.g. <ENTER>
+        self._rx = []
+        self._tx_rec = [0.0]
+        self._open_tx = None
+        for t, direction, data in transcript:
+            if direction == 'tx':
+                self._tx_rec.append(t)
+            elif direction == 'rx':
+                if self._open_tx is None:
+                    self._open_tx = len(self._tx_rec) - 1
+                self._rx.append((t, data, len(self._tx_rec) - 1))
+
+        Terminal.__init__(self, **kvargs)
+
+    # -------------------------------------------------------------------------
+    # I/O open close called from Terminal class
+    # -------------------------------------------------------------------------
+
+    def _tty_open(self):
+        self._next = 0
+        self._tx_at = [time()] * (1 + (self._open_tx or 0))
+
+    def _tty_close(self):
+        pass
+
+    # -------------------------------------------------------------------------
+    # I/O read and write called from Terminal class
+    # -------------------------------------------------------------------------
+
+    def write(self, content):
+        """ write content + <ENTER> """
+        self.rawwrite(content + '\n')
+
+    def rawwrite(self, content):
+        """ take the write, releasing the data recorded after it """
+        self._wire_tx(content)
+        self._tx_at.append(time())
+
+    def _due(self):
+        """ the time the next chunk is due, None if it is not yet """
+        t, data, ntx = self._rx[self._next]
+        if ntx >= len(self._tx_at):
+            return None     # waiting for a write
+        if not self.speed:
+            return self._tx_at[ntx]
+        return self._tx_at[ntx] + (t - self._tx_rec[ntx]) / self.speed
+
+    def _read_ready(self):
+        """ wait for the next chunk to be due, and return it """
+        if self._next >= len(self._rx):
+            sleep(self.TIMEOUT)
+            return ''
+        due = self._due()
+        wait = self.TIMEOUT if due is None else due - time()
+        if wait > self.TIMEOUT:
+            sleep(self.TIMEOUT)
+            return ''
+        if wait > 0:
+            sleep(wait)
+        data = self._rx[self._next][1]
+        self._next += 1
+        return self._wire_rx(data)
+
+    def read(self):
+        """ read a single line """
+        deadline = time() + self.EXPECT_TIMEOUT
+        while '\n' not in self._rxbuf:
+            if self._next >= len(self._rx):
+                raise RuntimeError("replay: end of transcript")
+            if time() >= deadline:
+                raise RuntimeError("replay: no data for the write made")
+            self._rxbuf += self._read_ready()
+
+        line, eol, self._rxbuf = self._rxbuf.partition('\n')
+        return line + eol
@@ -1,7 +1,6 @@
 import serial
-import re
-from time import sleep
-from datetime import datetime, timedelta
+import string
+from time import time
 
 from .tty import Terminal
 
@@ -9,10 +8,12 @@ from .tty import Terminal
 # Terminal connection over SERIAL CONSOLE
 # -------------------------------------------------------------------------
 
-_PROMPT = re.compile('|'.join(Terminal._RE_PAT))
-
 
 class Serial(Terminal):
+    BAUD = 9600             # default baud rate
+    BAUD_PROBE = [9600, 115200, 19200, 38400, 57600]
+    PROBE_TIMEOUT = 2       # seconds to wait for a prompt at each speed
+    SPEED_CONFIRM = 5       # seconds the device waits for a speed change ok
 
     def __init__(self, port='/dev/ttyUSB0', **kvargs):
         """
@@ -22,6 +23,17 @@ class Serial(Terminal):
         :kvargs['timeout']:
           this is the tty read polling timeout.
           generally you should not have to tweak this.
+
+        :kvargs['flow']:
+          serial flow control, 'xonxoff' or 'rtscts'; defaults to none
+
+        :kvargs['baud']:
+          the serial port baud rate, defaults to :BAUD:.  'auto' probes
+          the :BAUD_PROBE: rates until a prompt is recognised.
+
+        :kvargs['baud_upgrade']:
+          once logged in at the shell, switch the device console and the
+          serial port to this baud rate for the session
         """
         # initialize the underlying TTY device
 
@@ -30,6 +42,18 @@ class Serial(Terminal):
         self._ser.port = port
         self._ser.timeout = kvargs.get('timeout', self.TIMEOUT)
 
+        flow = kvargs.get('flow')
+        if flow not in (None, 'xonxoff', 'rtscts'):
+            raise ValueError("unknown flow control: {0}".format(flow))
+        self._ser.xonxoff = (flow == 'xonxoff')
+        self._ser.rtscts = (flow == 'rtscts')
+
+        self.baud = kvargs.get('baud') or self.BAUD
+        if self.baud != 'auto':
+            self._ser.baudrate = int(self.baud)
+        self.baud_upgrade = kvargs.get('baud_upgrade')
+        self._baud_login = None
+
         self._tty_name = self.port
 
         Terminal.__init__(self, **kvargs)
@@ -43,52 +67,177 @@ class Serial(Terminal):
             self._ser.open()
         except OSError as err:
             raise RuntimeError("open_failed:{0}".format(err.strerror))
-        self.write('\n\n\n')      # hit <ENTER> a few times, yo!
+        except serial.SerialException as err:
+            # pyserial reports a port held by another session this way,
+            # "Device or resource busy" or "Could not exclusively lock"
+            if 'busy' in str(err) or 'lock' in str(err):
+                raise RuntimeError("open_fail: port in use")
+            raise RuntimeError("open_failed:{0}".format(err))
+        if self.baud == 'auto':
+            self._baud_probe()
+        else:
+            self.write('\n\n\n')      # hit <ENTER> a few times, yo!
 
     def _tty_close(self):
         self._ser.flush()
         self._ser.close()
 
+    # -------------------------------------------------------------------------
+    # baud rate detection and session speed upgrade
+    # -------------------------------------------------------------------------
+
+    def _flush_input(self):
+        self._rxbuf = ''
+        try:
+            self._ser.reset_input_buffer()
+        except AttributeError:
+            self._ser.flushInput()          # pyserial < 3.0
+
+    def _probe_prompt(self):
+        """
+        hit <ENTER> and wait for a prompt at the current baud rate; at the
+        wrong rate the text is garbled, so it must also be readable
+        """
+        self._flush_input()
+        self.write('')
+        text, found = self.read_prompt(self.PROBE_TIMEOUT)
+        if found is None:
+            return (None, None)
+        readable = len([c for c in text if c in string.printable])
+        if readable < 0.9 * len(text):
+            return (None, None)
+        return (text, found)
+
+    def _baud_probe(self):
+        """ find the console baud rate """
+        for baud in self.BAUD_PROBE:
+            self._ser.baudrate = baud
+            text, found = self._probe_prompt()
+            if found is not None:
+                self.notify('TTY', 'detected {0} baud'.format(baud))
+                self._rxbuf = text      # for the login state-machine
+                return
+        # nothing recognised, the device may be booting; so carry on at
+        # the default rate and let the login state-machine wait for it
+        self._ser.baudrate = self.BAUD
+        self.notify('TTY', 'baud rate not detected, using {0}'.format(self.BAUD))
+        self.write('')
+
+    def _set_port_speed(self, baud):
+        """ switch the serial port to :baud:, returns False if refused """
+        try:
+            self._ser.baudrate = baud
+        except (ValueError, IOError, serial.SerialException) as err:
+            self.notify('TTY', 'serial port speed {0} refused: {1}'.format(
+                baud, err))
+            return False
+        return True
+
+    def _set_speed(self, baud):
+        """
+        change the device console speed from the shell and switch the
+        serial port to match.  the device reverts to the current speed by
+        itself unless the new one is confirmed within SPEED_CONFIRM
+        seconds, so if the prompt is not seen at the new rate both ends
+        fall back to the current one.  returns True when changed.
+        """
+        current = self._ser.baudrate
+        self.write("sh -c 'stty {0}; read -t {1} ok; "
+                   "[ \"$ok\" = ok ] || stty {2}'".format(
+                       baud, self.SPEED_CONFIRM, current))
+
+        # the echo of the command comes back at the current rate
+        mark_end = time() + self.PROBE_TIMEOUT
+        while time() < mark_end and 'stty' not in self.read():
+            pass
+
+        if self._set_port_speed(baud):
+            self.write('ok')        # confirm, only readable at the new rate
+            text, found = self._probe_prompt()
+            if found is not None:
+                self._rxbuf = text  # for the next reader, e.g. logout
+                return True
+
+        # the device reverts once the confirmation times out, or as soon
+        # as the garbled <ENTER> of a probe is read
+        self._set_port_speed(current)
+        mark_end = time() + self.SPEED_CONFIRM + self.PROBE_TIMEOUT
+        while time() < mark_end:
+            text, found = self._probe_prompt()
+            if found is not None:
+                self._rxbuf = text
+                return False
+        raise RuntimeError("console speed change to {0} failed".format(baud))
+
+    def _tty_post_login(self):
+        if not self.baud_upgrade:
+            return
+        if not self.at_shell:
+            self.notify('TTY', 'speed upgrade needs a shell login, skipped')
+            return
+
+        baud = self._ser.baudrate
+        if self._set_speed(int(self.baud_upgrade)):
+            self._baud_login = baud
+            self.notify('TTY', 'console speed {0} -> {1}'.format(
+                baud, self.baud_upgrade))
+        else:
+            self.notify('TTY', 'console speed unchanged at {0}'.format(baud))
+
+    def _tty_pre_logout(self):
+        # put the console back the way we found it
+        if self._baud_login is not None:
+            self._set_speed(self._baud_login)
+            self._baud_login = None
+
+    def _tty_pre_relogin(self):
+        # the device console comes back up at its configured rate, so
+        # the serial port goes back to the rate the login was made at
+        if self._baud_login is not None:
+            self._ser.baudrate = self._baud_login
+            self._baud_login = None
+
     # -------------------------------------------------------------------------
     # I/O read and write called from Terminal class
     # -------------------------------------------------------------------------
 
     def write(self, content):
         """ write content + <RETURN> """
-        self._ser.write(content + '\n')
+        self._ser.write(self._wire_tx(content + '\n'))
         self._ser.flush()
 
     def rawwrite(self, content):
-        self._ser.write(content)
+        self._ser.write(self._wire_tx(content))
+
+    def _write_chunk(self, chunk):
+        """
+        write the chunk and wait until it has been sent, so large transfers
+        go at the line rate, paused by the device with XON/XOFF or RTS/CTS
+        """
+        self._ser.write(self._wire_tx(chunk))
+        self._ser.flush()
 
     def read(self):
         """ read a single line """
-        return self._ser.readline()
+        line, eol, self._rxbuf = self._rxbuf.partition('\n')
+        if eol:
+            return line + eol
+        return line + self._wire_rx(self._ser.readline())
 
-    def read_prompt(self):
+    def _read_ready(self):
         """
-        reads text from the serial console (using readline) until
-        a match is found against the :expect: regular-expression object.
-        When a match is found, return a tuple(<text>,<found>) where
-        <text> is the complete text and <found> is the name of the
-        regular-expression group. If a timeout occurs, then return
-        the tuple(None,None).
+        wait for data to arrive on the serial port, and return everything
+        that is available.  the read(1) wakes as soon as the first byte is
+        received (or after the port timeout), the remaining bytes already
+        waiting are then taken in one call.
         """
-        rxb = ''
-        mark_start = datetime.now()
-        mark_end = mark_start + timedelta(seconds=self.EXPECT_TIMEOUT)
-
-        while datetime.now() < mark_end:
-            sleep(0.1)                          # do not remove
-            line = self._ser.readline()
-            if not line:
-                continue
-            rxb += line
-            found = _PROMPT.search(rxb)
-            if found is not None:
-                break         # done reading
-        else:
-            # exceeded the while loop timeout
-            return (None, None)
-
-        return (rxb, found.lastgroup)
+        data = self._ser.read(1)
+        if not data:
+            return data
+        try:
+            waiting = self._ser.in_waiting
+        except AttributeError:
+            waiting = self._ser.inWaiting()     # pyserial < 3.0
+        if waiting:
+            data += self._ser.read(waiting)
+        return self._wire_rx(data)
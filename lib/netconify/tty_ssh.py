@@ -1,11 +1,97 @@
 from select import select
+import os
+import threading
 import paramiko
-import re
 import logging
-from time import sleep, time
 from .tty import Terminal
 
-_PROMPT = re.compile('|'.join(Terminal._RE_PAT))
+# -------------------------------------------------------------------------
+# host keys, parsed once per process
+# -------------------------------------------------------------------------
+
+_known_hosts = None
+_known_hosts_lock = threading.Lock()
+
+
+def _system_host_keys():
+    """ the system known_hosts file, parsed on first use """
+    global _known_hosts
+    with _known_hosts_lock:
+        if _known_hosts is None:
+            _known_hosts = paramiko.HostKeys()
+            try:
+                _known_hosts.load(os.path.expanduser('~/.ssh/known_hosts'))
+            except IOError:
+                pass
+    return _known_hosts
+
+
+class _KnownHostsPolicy(paramiko.MissingHostKeyPolicy):
+
+    """
+    checks the console server key against the shared system host keys;
+    a changed key is rejected, an unknown key is accepted the same as
+    paramiko.AutoAddPolicy
+    """
+
+    def missing_host_key(self, client, hostname, key):
+        known = _system_host_keys().lookup(hostname)
+        if known is not None and key.get_name() in known:
+            if known[key.get_name()] != key:
+                raise paramiko.BadHostKeyException(
+                    hostname, key, known[key.get_name()])
+        client.get_host_keys().add(hostname, key.get_name(), key)
+
+# -------------------------------------------------------------------------
+# console server connection pool
+# -------------------------------------------------------------------------
+
+
+class _ConsoleServerPool(object):
+
+    """
+    authenticated SSH connections to console servers, keyed by
+    (host, port, user, password).  all of the SecureShell sessions to the
+    same console server share one connection, each on its own channel;
+    the connection is closed when the last session is released.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._servers = {}
+
+    def acquire(self, key, connect):
+        """ return the SSHClient for :key:, calling :connect: if needed """
+        with self._lock:
+            server = self._servers.setdefault(
+                key, dict(lock=threading.Lock(), client=None, sessions=0))
+            server['sessions'] += 1
+
+        # serialize on the server only, so the sessions to this server
+        # wait for a single handshake while others proceed
+        with server['lock']:
+            client = server['client']
+            if client is None or not client.get_transport() or \
+                    not client.get_transport().is_active():
+                try:
+                    server['client'] = client = connect()
+                except:
+                    self.release(key)
+                    raise
+            return client
+
+    def release(self, key):
+        """ release a session, closing the connection after the last one """
+        with self._lock:
+            server = self._servers[key]
+            server['sessions'] -= 1
+            if server['sessions'] > 0:
+                return
+            del self._servers[key]
+        if server['client'] is not None:
+            server['client'].close()
+
+_pool = _ConsoleServerPool()
 
 
 class SecureShell(Terminal):
@@ -13,14 +99,20 @@ class SecureShell(Terminal):
     SSH_LOGIN_RETRY = 1  # number off ssh login retry to console server
     SELECT_WAIT = 0.1
     RECVSZ = 1024
+    EXPECT_TIMEOUT = 15     # total prompt read timeout, seconds
 
     def __init__(self, host, port, s_user, s_passwd, **kvargs):
         """
         Utility Constructor
+
+        :kvargs['channel']:
+          optional command run on the console server to attach the
+          channel to the target port, e.g. 'pmshell -l port05'.  sessions
+          to the same console server and user share one SSH connection.
         """
-        self._ssh = paramiko.SSHClient()
-        self._ssh.load_system_host_keys()
-        self._ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        self._ssh = None
+        self._chan = None
+        self.channel = kvargs.get('channel')
         self._logger = logging.getLogger('paramiko.transport')
         self._logger.disabled = True
         self.host = host
@@ -33,12 +125,19 @@ class SecureShell(Terminal):
 
         Terminal.__init__(self, **kvargs)
 
-    def _tty_open(self):
-        while True:
+    @property
+    def _pool_key(self):
+        return (self.host, int(self.port), self.s_user, self.s_passwd)
+
+    def _connect(self):
+        """ authenticate to the console server """
+        ssh = paramiko.SSHClient()
+        ssh.set_missing_host_key_policy(_KnownHostsPolicy())
+        for attempt in range(self.attempts):
             try:
-                self._ssh.connect(hostname=self.host, port=int(self.port),
-                                  username=self.s_user, password=self.s_passwd, timeout=self.timeout, allow_agent=False, look_for_keys=False)
-                break
+                ssh.connect(hostname=self.host, port=int(self.port),
+                            username=self.s_user, password=self.s_passwd, timeout=self.timeout, allow_agent=False, look_for_keys=False)
+                return ssh
             except paramiko.BadHostKeyException:
                 self.notify(
                     "SSH",
@@ -49,61 +148,59 @@ class SecureShell(Terminal):
                     "SSH",
                     "Bad username or password when connecting to {0}".format(
                         self.host))
-        else:
-            raise RuntimeError("open_fail: ssh port not ready")
+        raise RuntimeError("open_fail: ssh port not ready")
 
-        self._chan = self._ssh.invoke_shell()
+    def _tty_open(self):
+        self._ssh = _pool.acquire(self._pool_key, self._connect)
+        try:
+            if self.channel is None:
+                self._chan = self._ssh.invoke_shell()
+            else:
+                self._chan = self._ssh.get_transport().open_session()
+                self._chan.get_pty()
+                self._chan.exec_command(self.channel)
+        except:
+            _pool.release(self._pool_key)
+            raise
         self.write('\n')
 
     def write(self, data):
         """ write data + <ENTER> """
-        self._chan.send(data)
-        self._chan.send('\n')
+        self._chan.sendall(self._wire_tx(data + '\n'))
 
     def rawwrite(self, data):
         """ write data only"""
-        self._chan.send(data)
+        self._chan.sendall(self._wire_tx(data))
+
+    def _recv(self):
+        """ receive the next chunk from the channel """
+        data = self._chan.recv(self.RECVSZ)
+        if data is None or len(data) <= 0:
+            raise ValueError('Unable to detect device prompt')
+        return self._wire_rx(data)
+
+    def _read_ready(self):
+        """ wait for data to arrive, and return the next chunk """
+        rd, wr, err = select([self._chan], [], [], self.SELECT_WAIT)
+        return self._recv() if rd else ''
 
     def read(self):
         """
-            read a single line
-            this is and ugly hack to mimic serial and telnet which reads one byte at a time
+            read a single line, with its <NEWLINE> as the other transports.
+            data is received in bulk into the read buffer, and any bytes
+            following the line are kept there for the next read() or
+            read_prompt()
         """
-        gotr = []
-        while True:
-            data = self._chan.recv(1)
-            if data is None or len(data) <= 0:
-                raise ValueError('Unable to detect device prompt')
-            elif '\n' in data:
-                self._prompt = data.split('\n')[0].strip()
-                break
-            else:
-                gotr.append(data)
+        while '\n' not in self._rxbuf:
+            self._rxbuf += self._recv()
 
-        self._rt = ''.join(str(s) for s in gotr)
-        return self._rt
+        line, eol, self._rxbuf = self._rxbuf.partition('\n')
+        return line + eol
 
     def _tty_close(self):
         """ Close the SSH client channel """
+        if self._chan is None:
+            return
         self._chan.close()
-
-    def read_prompt(self):
-        got = []
-        timeout = time() + 15.0
-
-        while time() < timeout:
-            sleep(0.1)
-            rd, wr, err = select([self._chan], [], [], self.SELECT_WAIT)
-            sleep(0.05)
-            if rd:
-                data = self._chan.recv(self.RECVSZ)
-                got.append(data)
-                found = _PROMPT.search(data)
-                if found is not None:
-                    break
-        else:
-            # exceeded the while loop timeout
-            raise RuntimeError(
-                "Netconify Error: ssh could not find string Login:")
-
-        return (got, found.lastgroup)
\ No newline at end of file
+        self._chan = None
+        _pool.release(self._pool_key)
@@ -1,4 +1,5 @@
 from time import sleep
+from select import select
 import telnetlib
 
 from .tty import Terminal
@@ -24,6 +25,11 @@ class Telnet(Terminal):
         :kvargs['timeout']:
           this is the tty read polling timeout.
           generally you should not have to tweak this.
+
+        :kvargs['retry_open']:
+          number of attempts to open the TTY, defaults to RETRY_OPEN.
+          the fleet uses a single attempt, its scheduler retries the
+          device later instead of holding its slot
         """
         # initialize the underlying TTY device
 
@@ -31,6 +37,7 @@ class Telnet(Terminal):
         self.host = host
         self.port = port
         self.timeout = kvargs.get('timeout', self.TIMEOUT)
+        self.retry_open = kvargs.get('retry_open') or self.RETRY_OPEN
         self._tty_name = "{0}:{1}".format(host, port)
 
         Terminal.__init__(self, **kvargs)
@@ -40,15 +47,16 @@ class Telnet(Terminal):
     # -------------------------------------------------------------------------
 
     def _tty_open(self):
-        retry = self.RETRY_OPEN
+        retry = self.retry_open
         while retry > 0:
             try:
                 self._tn.open(self.host, self.port, self.timeout)
                 break
             except Exception as err:
                 retry -= 1
-                self.notify("TTY busy", "checking back in {0} ...".format(self.RETRY_BACKOFF))
-                sleep(self.RETRY_BACKOFF)
+                if retry > 0:
+                    self.notify("TTY busy", "checking back in {0} ...".format(self.RETRY_BACKOFF))
+                    sleep(self.RETRY_BACKOFF)
         else:
             raise RuntimeError("open_fail: port not ready")
 
@@ -63,22 +71,37 @@ class Telnet(Terminal):
 
     def write(self, content):
         """ write content + <ENTER> """
-        self._tn.write(content + '\n')
+        self._tn.write(self._wire_tx(content + '\n'))
 
     def rawwrite(self, content):
         """ write content as-is """
-        self._tn.write(content)
+        self._tn.write(self._wire_tx(content))
 
     def read(self):
         """ read a single line """
-        return self._tn.read_until('\n', self.EXPECT_TIMEOUT)
-
-    def read_prompt(self):
-        got = self._tn.expect(Terminal._RE_PAT, self.EXPECT_TIMEOUT)
-        sre = got[1]
-
-        if 'in use' in got[2]:
+        line, eol, self._rxbuf = self._rxbuf.partition('\n')
+        if eol:
+            return line + eol
+        return line + self._wire_rx(
+            self._tn.read_until('\n', self.EXPECT_TIMEOUT))
+
+    def _read_ready(self):
+        """ wait for data to arrive, and return everything received """
+        if not self._tn.cookedq and not self._tn.sock_avail():
+            select([self._tn], [], [], self.timeout)
+        return self._wire_rx(self._tn.read_very_eager())
+
+    def read_prompt(self, timeout=None):
+        try:
+            got = Terminal.read_prompt(self, timeout)
+        except EOFError:
+            # the terminal server may hang up right after saying so
+            if 'in use' in self._matcher.text:
+                raise RuntimeError("open_fail: port already in use")
+            raise
+
+        if 'in use' in (got[0] or '') + self._rxbuf:
             raise RuntimeError("open_fail: port already in use")
 
         # (buffer, RE group)
-        return (None, None) if not got[1] else (got[2], got[1].lastgroup)
+        return got
@@ -15,6 +15,7 @@ setup(
     keywords="Junos NETCONF basic CONSOLE automation",
     url="http://www.github.com/Juniper/py-junos-netconify",
     install_requires=requirements,
+    extras_require={'gevent': ['gevent']},
     packages=find_packages('lib'),
     package_dir={'': 'lib'},
     scripts=['tools/netconify'],